@@ -0,0 +1,173 @@
+import asyncio
+import dataclasses
+
+from aiohttp import web
+
+# Local imports
+import cache
+import config
+import fetch
+import metrics
+import parse
+import resilience
+import scheduler
+import scrape
+from records import ClubResult
+
+# Local JSON API over the scrape layer, for services that want the bot's data without Discord:
+#     GET  /player/<id>              --> Same data as !player (scrape.get_stats)
+#     GET  /club/<id>?name=<name>    --> Same data as !club (scrape.process_df_clubs)
+#     GET  /search/players?q=<name>  --> Players found by scrape.search_player
+#     GET  /search/clubs?q=<name>    --> Clubs found by scrape.search_club
+#     POST /players {"ids": [...]}   --> {"results": {id: player, or {"error": ...}}}
+#     POST /clubs {"ids": [...]}     --> {"results": {id: club, or {"error": ...}}}
+# Run headless beside the bot, it shares the cache file, and the rate limits and fetches in flight
+# once every process is started with RATE_PROCESSES (see config.rate_processes).
+
+# Below is a function that retrieves a player's profile, season stats and rumors by transfermarkt ID.
+async def player_data(player_id):
+    """
+    Arguments: player_id (str) --> Player's TransferMarkt ID
+    Returns: data (dict) --> 'player' (info), 'performance' (season stats json) and 'rumors'
+    """
+    # Transfermarkt ignores the name part of profile links
+    p_info = {'link': f'{config.tm_main}/-/profil/spieler/{player_id}'}
+    p_info, player_stats_json, player_rumors = await scrape.get_stats(p_info)
+    return {'player': p_info, 'performance': player_stats_json, 'rumors': player_rumors}
+
+# Below is a function that retrieves a club's league, form and next matches by transfermarkt ID.
+async def club_data(club_id, name=''):
+    return await scrape.process_df_clubs(ClubResult(name=name, link=f'{config.tm_main}/-/startseite/verein/{club_id}'))
+
+# Below is a function that checks a transfermarkt ID taken from a request.
+def checked_id(value):
+    if not str(value).isdigit():
+        raise web.HTTPBadRequest(text='{"error": "IDs must be numeric"}', content_type='application/json')
+    return str(value)
+
+# Below is a function that answers a request with scraped data, or a json error if it could not be retrieved.
+async def respond(coro):
+    try:
+        return web.json_response(await coro)
+    except fetch.fetch_errors as error:
+        return web.json_response({'error': type(error).__name__}, status=502)
+    except Exception as error:
+        # Ex. a page that could not be parsed, answered in json like the errors of the batch endpoints
+        return web.json_response({'error': type(error).__name__}, status=500)
+
+@metrics.command_timed('api_player')
+async def handle_player(request):
+    return await respond(player_data(checked_id(request.match_info['id'])))
+
+@metrics.command_timed('api_club')
+async def handle_club(request):
+    return await respond(club_data(checked_id(request.match_info['id']), request.query.get('name', '')))
+
+@metrics.command_timed('api_search')
+async def handle_search(request):
+    search = scrape.search_player if request.match_info['kind'] == 'players' else scrape.search_club
+    query = request.query.get('q', '')
+    if not query.strip():
+        raise web.HTTPBadRequest(text='{"error": "Missing q"}', content_type='application/json')
+
+    async def results():
+        return [dataclasses.asdict(result) for result in await search(query)]
+    return await respond(results())
+
+# Below is a function that resolves many IDs in one call, at most api_batch_concurrency at a time.
+async def batch(request, retrieve):
+    """
+    Arguments:
+        - request (aiohttp.web.Request) --> POST request with a json body {"ids": [...]}
+        - retrieve (function) --> player_data or club_data
+    Returns: response (aiohttp.web.Response) --> {"results": {id: data, or {"error": ...} if it failed}}
+    """
+    try:
+        ids = (await request.json())['ids']
+        if not isinstance(ids, list):
+            # A string would otherwise be read one digit at a time
+            raise TypeError
+        ids = [checked_id(value) for value in ids]
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(text='{"error": "Expected {\\"ids\\": [...]}"}', content_type='application/json')
+    if len(ids) > config.api_batch_max:
+        raise web.HTTPBadRequest(text=f'{{"error": "At most {config.api_batch_max} IDs per call"}}',
+                                 content_type='application/json')
+
+    slots = asyncio.Semaphore(config.api_batch_concurrency)
+
+    async def resolve(key):
+        async with slots:
+            try:
+                return await retrieve(key)
+            except Exception as error:
+                # One failed ID (ex. a page that could not be parsed) never fails the whole batch
+                return {'error': type(error).__name__}
+
+    # Duplicate IDs are resolved once
+    ids = list(dict.fromkeys(ids))
+    results = await asyncio.gather(*[resolve(key) for key in ids])
+    return web.json_response({'results': dict(zip(ids, results))})
+
+@metrics.command_timed('api_players')
+async def handle_players(request):
+    return await batch(request, player_data)
+
+@metrics.command_timed('api_clubs')
+async def handle_clubs(request):
+    return await batch(request, club_data)
+
+# Below is a function that builds the API application.
+def make_app():
+    app = web.Application()
+    app.router.add_get('/player/{id}', handle_player)
+    app.router.add_get('/club/{id}', handle_club)
+    app.router.add_get('/search/{kind:players|clubs}', handle_search)
+    app.router.add_post('/players', handle_players)
+    app.router.add_post('/clubs', handle_clubs)
+    return app
+
+# Below is a function that starts the API on a local port and returns its runner (for cleanup).
+async def start_server(port):
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    await web.TCPSite(runner, config.api_host, port).start()
+    return runner
+
+# Below is a function that registers the metrics collectors of the scrape layer (used by the bot and the headless API).
+def register_collectors():
+    metrics.collectors['cache'] = cache.store.stats
+    metrics.collectors['scheduler'] = scheduler.outbound.stats
+    metrics.collectors['parse'] = parse.stats
+    metrics.collectors['revalidation'] = lambda: {'endpoint': fetch.revalidations}
+    metrics.collectors['parse_memo'] = lambda: scrape.parse_memo
+    if cache.flights is not None:
+        metrics.collectors['shared_flights'] = cache.flights.stats
+    metrics.collectors['endpoint'] = lambda: {'endpoint': {name: monitor.stats()
+                                                           for name, monitor in resilience.monitors.items()}}
+
+# Below is a function that runs the API without the Discord bot, until interrupted.
+async def serve():
+    port = config.api_port or config.api_port_default
+    register_collectors()
+    runner = await start_server(port)
+    # On its own port, as the bot's processes may run beside it
+    metrics_runner = await metrics.start_server(config.api_metrics_port) if config.api_metrics_port else None
+    print(f'Sonny API listening on http://{config.api_host}:{port}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await fetch.close()
+        parse.shutdown()
+
+def main():
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
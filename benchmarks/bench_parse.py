@@ -0,0 +1,134 @@
+"""
+Benchmark of parse.py against the original full BeautifulSoup parsing, over saved pages.
+
+Usage: python benchmarks/bench_parse.py [--pages DIR] [--runs N]
+
+DIR must contain search.html, profile.html and spielplan.html. 'profile stream' feeds the
+profile page to the early-terminating ProfileExtractor in chunks. The default fixtures are
+stand-in pages mirroring transfermarkt's markup; point --pages at real saved pages for
+representative numbers. Memory is the peak Python heap measured by tracemalloc, so it
+shows the soup objects that are no longer built but not lxml's C-side tree.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import config
+import parse
+
+# Below are the original BeautifulSoup parsers, kept as the baseline.
+def soup_quick_search(page):
+    soup = BeautifulSoup(page, 'lxml')
+    results = {'players': [], 'clubs': [], 'coaches': []}
+    for result in soup.find_all('tr', {'class':['even', 'odd']}):
+        if len(result.find_all('a')) < 2:
+            continue
+        if 'spieler' in result.find_all('a')[1].get('href'):
+            results['players'].append({'name': result.find_all('td')[2].get_text(),
+                                       'club': result.find_all('td')[3].get_text(),
+                                       'position': result.find_all('td')[4].get_text(),
+                                       'link': config.tm_main + result.find_all('a')[1].get('href')})
+        elif 'trainer' in result.find_all('a')[1].get('href'):
+            results['coaches'].append({'name': result.find_all('td')[2].get_text(),
+                                       'club': result.find_all('td')[3].get_text(),
+                                       'link': config.tm_main + result.find_all('a')[1].get('href')})
+    for x in soup.find_all('td', {'class':'hauptlink'}):
+        if x.find_all('a'):
+            if 'startseite' in x.find_all('a')[0].get('href'):
+                results['clubs'].append({'name': x.find_all('a')[0].get('title'),
+                                         'link': config.tm_main + x.find_all('a')[0].get('href')})
+    return results
+
+def soup_player_profile(page):
+    soup = BeautifulSoup(page, 'lxml')
+    header = {}
+    header['image_url'] = soup.find('img', {'class': 'data-header__profile-image'}).get('src')
+    for label in soup.find_all('li', {'class': 'data-header__label'}):
+        if label.get_text(strip=True).startswith('Position:'):
+            header['position'] = label.get_text(strip=True).replace('Position:', '')
+    try:
+        status = soup.find_all('div', {'class': 'verletzungsbox'})[0].find_all('div', {'class': 'text'})[0].get_text(separator = ': ', strip=True)
+    except IndexError:
+        status = "Available"
+    header['clublink'] = soup.find_all('span', {'class': 'data-header__club'})[0].find_all('a')[0].get('href')
+    return header, status
+
+def soup_club_page(page):
+    soup = BeautifulSoup(page, 'lxml')
+    header, form = {}, {}
+    img_query = soup.find_all('div', {'class':'data-header__profile-container'})[0]
+    header['image_url'] = img_query.find('img').get('src')
+    header['league'] = soup.find_all('span', {'class':"data-header__club"})[0].get_text(strip=True)
+    header['league_link'] = soup.find_all('span', {'class':"data-header__club"})[0].find('a').get('href')
+    form['standing'] = soup.find_all('span', {'class':"data-header__content"})[1].find('a').get_text(strip=True)
+    results = []
+    for x in soup.find_all('div', {'class': 'box'}):
+        h2_a = x.find('h2').find('a') if x.find('h2') else None
+        if h2_a and header['league_link'] in h2_a.get('href'):
+            table = x.find('div', {'class': 'responsive-table'}).find('table').find('tbody').find_all('tr')
+            for table_2 in table:
+                for match in table_2.find_all('td', {'class': 'zentriert'}):
+                    a_span = match.find('a').find('span') if match.find('a') else None
+                    if a_span:
+                        score = a_span.text.strip()
+                        if score[0] != '-':
+                            result = a_span.get('class')
+                            results.append('D' if not result else 'W' if result[0] == 'greentext' else 'L')
+    form['past_results'] = (" ").join(results[-5:])
+    return header, form
+
+# Below is a function that feeds a page to the streaming profile extractor in chunks, like fetch_streamed.
+def stream_player_profile(page):
+    extractor = parse.ProfileExtractor()
+    for start in range(0, len(page), config.stream_chunk_size):
+        if extractor.feed(page[start:start + config.stream_chunk_size]):
+            break
+    stream_player_profile.bytes_read = extractor.bytes_read
+    return extractor.result()
+
+# Below is a function to time a parser and measure its peak traced memory.
+def measure(parser, page, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        parser(page)
+    elapsed = (time.perf_counter() - start) / runs
+
+    tracemalloc.start()
+    parser(page)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+
+    cases = [('search', 'search.html', soup_quick_search, parse.parse_quick_search),
+             ('profile', 'profile.html', soup_player_profile, parse.parse_player_profile),
+             ('profile stream', 'profile.html', soup_player_profile, stream_player_profile),
+             ('spielplan', 'spielplan.html', soup_club_page, parse.parse_club_page)]
+
+    print(f"{'page':<16}{'soup ms':>10}{'parse ms':>10}{'speedup':>9}{'soup KiB':>10}{'parse KiB':>11}")
+    for label, name, baseline, targeted in cases:
+        with open(os.path.join(args.pages, name), 'rb') as f:
+            page = f.read()
+
+        # Both parsers must agree before their timings are compared
+        assert baseline(page) == targeted(page), f"{name}: parse.py output differs from baseline"
+
+        base_time, base_peak = measure(baseline, page, args.runs)
+        new_time, new_peak = measure(targeted, page, args.runs)
+        print(f"{label:<16}{base_time * 1000:>10.2f}{new_time * 1000:>10.2f}{base_time / new_time:>8.1f}x"
+              f"{base_peak / 1024:>10.0f}{new_peak / 1024:>11.0f}")
+        if targeted is stream_player_profile:
+            print(f"{'':<16}stopped after {stream_player_profile.bytes_read / 1024:.0f} of {len(page) / 1024:.0f} KiB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Offline replay benchmark of the !player and !club pipelines against the local stub server.
+
+Usage: python benchmarks/bench_replay.py [--users 20] [--commands 10] [--distinct 0]
+                                         [--latency 0.05] [--jitter 0.02] [--error-rate 0]
+                                         [--parse-executor thread] [--parse-workers 2]
+                                         [--rate-limit] [--json OUT] [--baseline FILE --tolerance 0.25]
+
+Each simulated user runs --commands iterations of !player followed by !club through
+search_player, get_stats (via process_df), search_club, process_df_clubs and the display_*
+embed builders. Throughput and p50/p95/p99 latency are reported per stage. With --distinct 0
+every query is unique (cold cache); otherwise queries cycle through that many names (warm cache).
+With --baseline, the run fails if any stage's p95 regresses by more than --tolerance.
+
+Event loop lag (how late a 5 ms timer fires) shows how much parsing blocks other commands;
+compare --parse-executor none, thread and process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stub_server
+
+stages = ['search_player', 'get_stats', 'display_player', 'search_club', 'process_df_clubs',
+          'display_club', 'player_command', 'club_command']
+
+# Below is a function returning the nearest-rank percentile of a sorted list.
+def percentile(ordered, p):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+# Below is a function that configures the bot modules to use the stub and an isolated cache.
+def load_bot_modules(port, cache_path, rate_limit, parse_executor, parse_workers):
+    os.environ['TM_BASE_URL'] = f'http://127.0.0.1:{port}'
+    import config
+    config.cache_path = cache_path
+    config.parse_executor = '' if parse_executor == 'none' else parse_executor
+    config.parse_workers = parse_workers
+    if not rate_limit:
+        config.rate_limit_host = (1e9, 1e9)
+        config.rate_limit_class = {kind: (1e9, 1e9) for kind in config.rate_limit_class}
+
+    import embeds
+    import fetch
+    import parse
+    import scrape
+    return embeds, fetch, parse, scrape
+
+# Below is a function that measures how late the event loop runs a short timer, until cancelled.
+async def measure_loop_lag(lags, interval=0.005):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - start - interval)
+
+async def run(args):
+    runner = await stub_server.start(args.port, latency=args.latency, jitter=args.jitter,
+                                     error_rate=args.error_rate, seed=0)
+    hits = runner.app['hits']
+    cache_dir = tempfile.TemporaryDirectory()
+    embeds, fetch, parse, scrape = load_bot_modules(args.port, os.path.join(cache_dir.name, 'cache.sqlite3'),
+                                                    args.rate_limit, args.parse_executor, args.parse_workers)
+    timings = {stage: [] for stage in stages}
+    failures = []
+
+    async def timed(stage, coro):
+        start = time.perf_counter()
+        result = await coro
+        timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def timed_sync(stage, func, *func_args):
+        start = time.perf_counter()
+        result = func(*func_args)
+        timings[stage].append(time.perf_counter() - start)
+        return result
+
+    async def player_command(query):
+        players = await timed('search_player', scrape.search_player(query))
+        info = await timed('get_stats', scrape.process_df(players[0]))
+        timed_sync('display_player', embeds.display_player, *info)
+
+    async def club_command(query):
+        clubs = await timed('search_club', scrape.search_club(query))
+        club_info = await timed('process_df_clubs', scrape.process_df_clubs(clubs[0]))
+        timed_sync('display_club', embeds.display_club, club_info)
+
+    async def user(user_id):
+        for i in range(args.commands):
+            n = user_id * args.commands + i
+            query = f'user {n}' if args.distinct == 0 else f'name {n % args.distinct}'
+            for stage, command in (('player_command', player_command), ('club_command', club_command)):
+                try:
+                    await timed(stage, command(query))
+                except Exception as e:
+                    failures.append(f'{stage}: {e!r}')
+
+    lags = []
+    lag_task = asyncio.ensure_future(measure_loop_lag(lags))
+    start = time.perf_counter()
+    await asyncio.gather(*[user(u) for u in range(args.users)])
+    wall = time.perf_counter() - start
+    lag_task.cancel()
+
+    await fetch.close()
+    parse.shutdown()
+    await runner.cleanup()
+    cache_dir.cleanup()
+
+    commands = len(timings['player_command']) + len(timings['club_command'])
+    return {'users': args.users,
+            'commands': commands,
+            'failures': len(failures),
+            'wall_s': wall,
+            'throughput_cmd_s': commands / wall,
+            'upstream_requests': sum(hits.values()),
+            'parse_executor': args.parse_executor,
+            'loop_lag_ms': {'p50': percentile(sorted(lags), 50) * 1000,
+                            'p99': percentile(sorted(lags), 99) * 1000,
+                            'max': max(lags, default=0) * 1000},
+            'stages': {stage: {'count': len(values),
+                               'p50_ms': percentile(sorted(values), 50) * 1000,
+                               'p95_ms': percentile(sorted(values), 95) * 1000,
+                               'p99_ms': percentile(sorted(values), 99) * 1000}
+                       for stage, values in timings.items()}}
+
+# Below is a function printing the results table.
+def report(results):
+    print(f"{results['users']} users, {results['commands']} commands in {results['wall_s']:.2f}s "
+          f"({results['throughput_cmd_s']:.1f} cmd/s), {results['upstream_requests']} upstream requests, "
+          f"{results['failures']} failures")
+    lag = results['loop_lag_ms']
+    print(f"parse executor: {results['parse_executor']}, event loop lag p50 {lag['p50']:.2f} ms, "
+          f"p99 {lag['p99']:.2f} ms, max {lag['max']:.2f} ms")
+    print(f"{'stage':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, row in results['stages'].items():
+        print(f"{stage:<18}{row['count']:>7}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+
+# Below is a function comparing p95 per stage against a baseline run.
+def regressions(results, baseline, tolerance):
+    found = []
+    for stage, row in results['stages'].items():
+        before = baseline['stages'].get(stage, {}).get('p95_ms')
+        if before and row['p95_ms'] > before * (1 + tolerance):
+            found.append(f"{stage}: p95 {row['p95_ms']:.2f} ms vs baseline {before:.2f} ms")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--commands', type=int, default=10)
+    parser.add_argument('--distinct', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--parse-executor', choices=['none', 'thread', 'process'], default='thread')
+    parser.add_argument('--parse-workers', type=int, default=2)
+    parser.add_argument('--rate-limit', action='store_true', help='keep the production rate limits')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print('REGRESSION', line)
+        if found:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Records a fresh fixture corpus from transfermarkt for the replay and parse benchmarks.
+
+Usage: python benchmarks/record.py "Erling Haaland" "Manchester City" [--league LINK] [--out DIR]
+
+Saves the quick search page for the player, the first result's profile page, performance and
+rumors json, the first club result's spielplan page, nextMatches json and kader (squad) page, and
+the league's tabelle page (the first of config.ingest_leagues by default). The stub server
+rewrites club IDs in nextMatches, so update stub_server.fixture_club_id if the club changes.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import config
+import fetch
+import parse
+
+async def record(player_query, club_query, league_link, out):
+    os.makedirs(out, exist_ok=True)
+
+    # Below is a function saving a raw response body into the corpus.
+    def save(name, body):
+        with open(os.path.join(out, name), 'wb') as f:
+            f.write(body)
+        print(f'{name}: {len(body)} bytes')
+
+    async def raw(url):
+        return await fetch.request(url, lambda response: response.read())
+
+    try:
+        search = await raw(config.tm_search + '+'.join(player_query.split()))
+        save('search.html', search)
+        player = parse.parse_quick_search(search)['players'][0]
+        player_id = player['link'].split('/')[-1]
+        save('profile.html', await raw(player['link']))
+        save('performance.json', await raw(config.tm_ceapi + '/player/' + player_id + '/performance'))
+        save('rumors.json', await raw(config.tm_ceapi + '/currentRumors/player/' + player_id))
+
+        club_search = await raw(config.tm_search + '+'.join(club_query.split()))
+        club = parse.parse_quick_search(club_search)['clubs'][0]
+        club_id = club['link'].split('/')[-1]
+        save('spielplan.html', await raw(club['link'].replace('startseite', 'spielplan')))
+        save('nextmatches.json', await raw(config.tm_ceapi + '/nextMatches/team/' + club_id))
+        print(f'club ID for stub_server.fixture_club_id: {club_id}')
+
+        # Pages read by the league ingestion (ingest.py)
+        save('league.html', await raw(config.tm_main + league_link.replace('startseite', 'tabelle')))
+        save('squad.html', await raw(club['link'].replace('startseite', 'kader')))
+    finally:
+        await fetch.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('player')
+    parser.add_argument('club')
+    parser.add_argument('--league', default=config.ingest_leagues[0],
+                        help="League startseite path, ex. '/premier-league/startseite/wettbewerb/GB1'")
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+    args = parser.parse_args()
+    asyncio.run(record(args.player, args.club, args.league, args.out))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Local transfermarkt stand-in serving the recorded fixture corpus, with configurable latency and errors.
+
+Usage: python benchmarks/stub_server.py [--port 8765] [--latency 0.05] [--jitter 0.02]
+                                        [--error-rate 0] [--throttle-rate 0]
+
+Run the bot against it with TM_BASE_URL=http://127.0.0.1:8765. Responses are compressed when the
+client accepts it, and carry an ETag so that conditional requests are answered with 304. Search pages are personalized
+per query (player and club IDs are shifted by a hash of the query), so distinct queries resolve
+to distinct players and clubs and are not served from the bot's cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import zlib
+
+from aiohttp import web
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Routes, checked in order: (path pattern, fixture file)
+routes = [(re.compile(r'^/schnellsuche/'), 'search.html'),
+          (re.compile(r'/tabelle/wettbewerb/'), 'league.html'),
+          (re.compile(r'/kader/verein/(\d+)'), 'squad.html'),
+          (re.compile(r'^/ceapi/player/(\d+)/performance$'), 'performance.json'),
+          (re.compile(r'^/ceapi/currentRumors/player/(\d+)$'), 'rumors.json'),
+          (re.compile(r'^/ceapi/nextMatches/team/(\d+)$'), 'nextmatches.json'),
+          (re.compile(r'/spielplan/verein/(\d+)'), 'spielplan.html'),
+          (re.compile(r'/profil/spieler/(\d+)'), 'profile.html')]
+
+# Club ID used by the recorded nextMatches fixture
+fixture_club_id = '281'
+
+# Below is a function shifting the player and club IDs of a search page by a hash of the query.
+def personalize_search(body, query):
+    offset = zlib.crc32(query.lower().encode()) % 1000000 * 1000
+    return re.sub(rb'/(spieler|verein)/(\d+)',
+                  lambda m: b'/%s/%d' % (m.group(1), int(m.group(2)) + offset), body)
+
+# Below is a function rewriting the nextMatches fixture so that the requested club plays every match.
+def personalize_next_matches(body, club_id):
+    data = json.loads(body)
+    data['teams'][club_id] = data['teams'].pop(fixture_club_id)
+    for match in data['matches']:
+        for side in ('home', 'away'):
+            if str(match['match'][side]) == fixture_club_id:
+                match['match'][side] = int(club_id)
+    return json.dumps(data).encode()
+
+# Below is a function shifting the player IDs of the squad fixture by the club ID, so every club has its own players.
+def personalize_squad(body, club_id):
+    offset = int(club_id) * 1000000
+    return re.sub(rb'/spieler/(\d+)', lambda m: b'/spieler/%d' % (int(m.group(1)) + offset), body)
+
+# Below is a function varying the performance fixture per player, so league-wide stats differ between players.
+def personalize_performance(body, player_id):
+    rng = random.Random(int(player_id))
+    data = json.loads(body)
+    for tournament in data:
+        for field in ('gamesPlayed', 'goalsScored', 'assists', 'cleanSheets', 'concededGoals'):
+            tournament[field] = rng.randint(0, tournament[field])
+        tournament['startElevenPercent'] = round(rng.uniform(0, 100), 4)
+    return json.dumps(data).encode()
+
+# Below is a function that builds the stub application.
+def make_app(latency=0.05, jitter=0.02, error_rate=0.0, throttle_rate=0.0, seed=None):
+    """
+    Arguments:
+        - latency (float) --> Mean response delay in seconds
+        - jitter (float) --> Standard deviation of the response delay in seconds
+        - error_rate (float) --> Probability of answering with a 500
+        - throttle_rate (float) --> Probability of answering with a 429 and Retry-After: 1
+        - seed (int) --> Optional seed for reproducible latency and error injection
+    Returns: app (aiohttp.web.Application) --> Stub application, with per-path hit counts in app['hits']
+             and the fixture bodies in app['fixtures'] (which can be replaced while it runs)
+    """
+    fixtures = {}
+    for name in os.listdir(fixtures_dir):
+        with open(os.path.join(fixtures_dir, name), 'rb') as f:
+            fixtures[name] = f.read()
+    rng = random.Random(seed)
+    hits = {}
+    last_modified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+
+    async def handler(request):
+        path = request.path
+        hits[path] = hits.get(path, 0) + 1
+        await asyncio.sleep(max(0, rng.gauss(latency, jitter)))
+
+        roll = rng.random()
+        if roll < throttle_rate:
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        if roll < throttle_rate + error_rate:
+            return web.Response(status=500)
+
+        for pattern, name in routes:
+            match = pattern.search(path)
+            if match is None:
+                continue
+            body = fixtures[name]
+            if name == 'search.html':
+                body = personalize_search(body, request.query.get('query', ''))
+            elif name == 'nextmatches.json':
+                body = personalize_next_matches(body, match.group(1))
+            elif name == 'squad.html':
+                body = personalize_squad(body, match.group(1))
+            elif name == 'performance.json':
+                body = personalize_performance(body, match.group(1))
+            # Validators let clients revalidate with a conditional request (304 Not Modified)
+            etag = '"%08x"' % zlib.crc32(body)
+            if request.headers.get('If-None-Match') == etag:
+                return web.Response(status=304, headers={'ETag': etag, 'Last-Modified': last_modified})
+            content_type = 'application/json' if name.endswith('.json') else 'text/html'
+            response = web.Response(body=body, content_type=content_type, charset='utf-8',
+                                    headers={'ETag': etag, 'Last-Modified': last_modified})
+            response.enable_compression()
+            return response
+        return web.Response(status=404)
+
+    app = web.Application()
+    app.router.add_route('GET', '/{tail:.*}', handler)
+    app['hits'] = hits
+    app['fixtures'] = fixtures
+    return app
+
+# Below is a function that starts the stub on a local port and returns its runner (for cleanup).
+async def start(port=8765, **options):
+    runner = web.AppRunner(make_app(**options))
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.jitter, args.error_rate, args.throttle_rate),
+                host='127.0.0.1', port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,33 @@
-# Import dependencies
+# Import dependencies (timed as the 'startup' stages of !stats; numpy and lxml are imported on first use)
+import time
+started = time.perf_counter()
+
 import asyncio
 import os
 import discord
 
-from discord.ext import commands
+from discord import app_commands
+from discord.ext import commands, tasks
 from dotenv import load_dotenv
 
+import api
+import cache
+import config
 import embeds
+import fetch
+import follow
+import ingest
+import metrics
+import names
+import parse
+import refresh
+import scheduler
 import scrape
+import shards
+import snapshot
+
+stats = metrics.lazy_import('stats')
+metrics.observe_startup('import_bot', time.perf_counter() - started)
 
 # Import Bot Discord Token
 load_dotenv()
@@ -16,14 +36,113 @@ TOKEN = os.getenv('DISCORD_TOKEN')
 intents = discord.Intents.default()
 intents.message_content = True
 
+# Bot subclass that serves local metrics (and the JSON API when API_PORT is set) and releases the
+# shared scrape session on shutdown (auto-sharded: runs every shard, or the shards given to this
+# process by shards.launch)
+class SonnyBot(commands.AutoShardedBot):
+    metrics_runner = None
+    api_runner = None
+
+    async def setup_hook(self):
+        # Warm the cache from the last snapshot before the bot connects, so the first commands start warm
+        start = time.perf_counter()
+        snapshot.load()
+        metrics.observe_startup('load_snapshot', time.perf_counter() - start)
+
+        api.register_collectors()
+        metrics.collectors['name_index'] = names.index.stats
+        metrics.collectors['stats_store'] = lambda: stats.store.stats()
+        metrics.collectors['follows'] = follow.follows.stats
+        if config.metrics_port:
+            self.metrics_runner = await metrics.start_server(config.metrics_port + config.process_index)
+
+        # Served from the bot's own cache, flights and rate limiter
+        if config.api_port:
+            self.api_runner = await api.start_server(config.api_port + config.process_index)
+
+        # Lookup counts are kept per process, so each one refreshes its own popular entries (a process
+        # skips those another one already refreshed, as they share the disk tier)
+        refresh_popular.start()
+        save_snapshot.start()
+
+        # Other background loops, and the registration of the /player and /club application commands with
+        # Discord, run in one process only
+        if config.process_index == 0:
+            ingest_leagues.start()
+            poll_followed_clubs.start()
+            await self.tree.sync()
+
+    async def close(self):
+        refresh_popular.cancel()
+        ingest_leagues.cancel()
+        poll_followed_clubs.cancel()
+        save_snapshot.cancel()
+        try:
+            snapshot.save()
+        except OSError:
+            pass
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        if self.api_runner is not None:
+            await self.api_runner.cleanup()
+        await fetch.close()
+        parse.shutdown()
+        await super().close()
+
 # Initialize client variable
-client = commands.Bot(command_prefix = '!', intents=intents, help_command=None)
+client = SonnyBot(command_prefix = '!', intents=intents, help_command=None,
+                  shard_ids=config.shard_ids, shard_count=config.shard_count)
+
+# Background refresh of popular players and clubs, on the bot's event loop
+@tasks.loop(seconds=config.refresh_interval)
+async def refresh_popular():
+    await refresh.refresh_popular()
+
+# Background ingestion of league squads and season stats into the local stats store
+@tasks.loop(seconds=config.ingest_interval)
+async def ingest_leagues():
+    await ingest.ingest_all()
+
+# Polling of followed clubs, posting their changes to the channels following them
+@tasks.loop(seconds=config.follow_tick)
+async def poll_followed_clubs():
+    await follow.poll_due(notify_followers)
+
+# Periodic snapshot of the hottest cache entries, so a restart after a crash also starts warm
+@tasks.loop(seconds=config.snapshot_interval)
+async def save_snapshot():
+    # The first iteration runs at startup, right after the snapshot was loaded
+    if save_snapshot.current_loop:
+        try:
+            snapshot.save()
+        except OSError:
+            pass
+
+# Below is a function that posts a followed club's changes to every channel following it.
+# (The channel may belong to a shard of another process, so it is not looked up in this one's cache.)
+async def notify_followers(channel_ids, club_name, changes):
+    embed = embeds.follow_update_embed(club_name, changes)
+    for channel_id in channel_ids:
+        try:
+            await client.get_partial_messageable(channel_id).send(embed=embed)
+        except discord.HTTPException:
+            # ex. the bot can no longer post in the channel
+            continue
 
 # Define boot-up message
 @client.event
 async def on_ready():
     print(f'{client.user} is running!')
 
+# Label every command's scrape, parse and embed stages with the command name for the metrics
+@client.before_invoke
+async def start_command_metrics(ctx):
+    ctx.metrics_scope = metrics.start_command(ctx.command.name)
+
+@client.after_invoke
+async def finish_command_metrics(ctx):
+    metrics.finish_command(ctx.metrics_scope)
+
 # !hello command for saying hello to the bot.
 @client.command(name='hello')
 async def hello(ctx):
@@ -34,6 +153,28 @@ async def hello(ctx):
 async def command_help(ctx):
     await ctx.send(embed=embeds.command_help())
 
+# !stats command (administrators only) for per-stage latencies, cache hit rates and queue depth.
+@client.command(name='stats')
+@commands.has_permissions(administrator=True)
+async def command_stats(ctx):
+    await ctx.send(embed=embeds.stats_embed(metrics.histograms, cache.store.stats(), scheduler.outbound.stats()))
+
+@command_stats.error
+async def command_stats_error(ctx, error):
+    if isinstance(error, commands.CheckFailure):
+        await ctx.send(embed=embeds.simple_embed('Error', "The !stats command is only available to administrators."))
+    else:
+        raise error
+
+# Below is a function that cancels the prefetches of search results the user did not select.
+def cancel_prefetches(prefetches, keep=None):
+    for index, task in enumerate(prefetches):
+        if index != keep:
+            task.cancel()
+        else:
+            # The selected player or club is now awaited by the command, which joins the prefetch's fetches
+            scrape.promote_prefetch(task)
+
 # !player command to retrieve player statistics from a particular season. (ex. !player Udogie)
 @client.command(name='player')
 async def get_player(ctx, *, command_args=''):
@@ -42,29 +183,32 @@ async def get_player(ctx, *, command_args=''):
         command_args (string): Name of player that the user wishes to search
     """
     # Convert command_args into searchable transfermarkt query
-    df = scrape.search_player(command_args)
+    players = await scrape.search_player(command_args)
 
-    # Process dataframe, check if there are no results, only one result, or multiple results
-    def process_and_display_df(df):
-        player_info, player_stats_json, player_rumors = scrape.process_df(df)
+    # Process results, check if there are no results, only one result, or multiple results
+    async def process_and_display_player(player):
+        player_info, player_stats_json, player_rumors = await scrape.process_df(player)
         embed = embeds.display_player(player_info, player_stats_json, player_rumors)
         return embed
 
     # Case 1: No results
-    if df.shape[0] == 0:
+    if len(players) == 0:
         msg = "The player name is invalid or does not exist. Please enter a valid name."
         await ctx.send(embed=embeds.simple_embed('Error', msg))
 
     # Case 2: One result
-    elif df.shape[0] == 1:
+    elif len(players) == 1:
         # Process info such as Active/Inactive, Name, Link, etc.
-        await ctx.send(embed=process_and_display_df(df))
+        await ctx.send(embed=await process_and_display_player(players[0]))
 
     # Case 3: More than one result
     else:
-        embed = embeds.resulting_players_embed(df, command_args)
+        embed = embeds.resulting_players_embed(players, command_args)
         await ctx.send(embed=embed)
 
+        # Prefetch the top results while the user picks one
+        prefetches = scrape.prefetch(scrape.prefetch_player, players)
+
         # Await for user's response
         def check_input(message):
             return message.author == ctx.author and message.channel == ctx.channel
@@ -74,17 +218,17 @@ async def get_player(ctx, *, command_args=''):
 
             # Retrieve selected index
             selected_index = int(response.content)-1
+            if not 0 <= selected_index < len(players):
+                raise ValueError
 
             # Process the selected player
-            try:
-                selected_df = df.iloc[[selected_index]]
-                selected_df = selected_df.reset_index(drop=True)
-            except IndexError:
-                msg = "Incorrect response entered. Please try the command again."
-                await ctx.send(embed=embeds.simple_embed('Error', msg))
+            selected_player = players[selected_index]
+
+            # Stop prefetching the players that were not selected
+            cancel_prefetches(prefetches, keep=selected_index)
 
             # Process info such as Active/Inactive, Name, Link, etc.
-            await ctx.send(embed=process_and_display_df(selected_df))
+            await ctx.send(embed=await process_and_display_player(selected_player))
 
         except asyncio.TimeoutError:
             msg = "Time limit exceeded. Please try the command again."
@@ -94,6 +238,9 @@ async def get_player(ctx, *, command_args=''):
             msg = "Incorrect response entered. Please try the command again."
             await ctx.send(embed=embeds.simple_embed('Error', msg))
 
+        finally:
+            cancel_prefetches(prefetches)
+
         # finally:
         #     # Delete the previous message
         #     await response.delete()
@@ -102,31 +249,33 @@ async def get_player(ctx, *, command_args=''):
 @client.command(name='club')
 async def get_club(ctx, *, command_args=''):
     # Convert args into searchable transfermarkt query
-    # Obtain dataframe of results
-    df = scrape.search_club(command_args)
+    # Obtain list of results
+    clubs = await scrape.search_club(command_args)
 
-    # Process dataframe, check if there are no results, only one result, or multiple results
-    def process_and_display_df_clubs(df):
-        club_info = scrape.process_df_clubs(df)
-        embed = embeds.display_club(club_info, df)
+    # Process results, check if there are no results, only one result, or multiple results
+    async def process_and_display_club(club):
+        club_info = await scrape.process_df_clubs(club)
+        embed = embeds.display_club(club_info)
         return embed
 
-    # Process dataframe, check if there are no results, only one result, or multiple results
     # Case 1: No results
-    if df.shape[0] == 0:
+    if len(clubs) == 0:
         msg = "The provided club name is invalid or does not exist. Please enter a valid club name."
         await ctx.send(embed=embeds.simple_embed('Error', msg))
 
     # Case 2: One result
-    elif df.shape[0] == 1:
+    elif len(clubs) == 1:
         # Below is where club information will be scraped, and output using embed
-        await ctx.send(embed=process_and_display_df_clubs(df))
+        await ctx.send(embed=await process_and_display_club(clubs[0]))
 
     # Case 3: More than one result
     else:
-        embed = embeds.resulting_clubs_embed(df, command_args)
+        embed = embeds.resulting_clubs_embed(clubs, command_args)
         await ctx.send(embed=embed)
 
+        # Prefetch the top results while the user picks one
+        prefetches = scrape.prefetch(scrape.prefetch_club, clubs)
+
         # Await for user's response
         def check_input(message):
             return message.author == ctx.author and message.channel == ctx.channel
@@ -136,13 +285,15 @@ async def get_club(ctx, *, command_args=''):
 
             # Retrieve selected index
             selected_index = int(response.content)-1
+            if not 0 <= selected_index < len(clubs):
+                raise ValueError
 
-            # Process selected club
-            selected_df = df.iloc[[selected_index]]
-            selected_df = selected_df.reset_index(drop=True)
+            # Process selected club, and stop prefetching the others
+            selected_club = clubs[selected_index]
+            cancel_prefetches(prefetches, keep=selected_index)
 
             # Below is where club information will be scraped, and output using embed
-            await ctx.send(embed=process_and_display_df_clubs(df))
+            await ctx.send(embed=await process_and_display_club(selected_club))
 
         except asyncio.TimeoutError:
             msg = "Time limit exceeded. Please try the command again."
@@ -153,8 +304,244 @@ async def get_club(ctx, *, command_args=''):
             await ctx.send(embed=embeds.simple_embed('Error', msg))
 
         finally:
+            cancel_prefetches(prefetches)
+
             # Delete the previous message
             await response.delete()
 
-# Run Discord Bot
-client.run(TOKEN)
+# !leaders command for the top players of an ingested league in one stat. (ex. !leaders Premier League goals)
+@client.command(name='leaders')
+async def get_leaders(ctx, *, command_args=''):
+    """
+    Arguments:
+        command_args (string): League name or code, followed by the stat to rank players by
+    """
+    # Pick up stats ingested by another bot process
+    stats.store.reload()
+
+    league, _, stat = command_args.strip().rpartition(' ')
+    stat = stat.lower()
+    if stat not in stats.stat_aliases:
+        msg = f"Please enter a league and one of these stats: {', '.join(stats.stat_aliases)}."
+        await ctx.send(embed=embeds.simple_embed('Error', msg))
+        return
+
+    code = stats.store.find_league(league)
+    if code is None:
+        msg = "The league is invalid or has not been loaded yet. Please enter a valid league name."
+        await ctx.send(embed=embeds.simple_embed('Error', msg))
+        return
+
+    field = stats.stat_aliases[stat]
+    leaders = stats.store.leaders(code, field, config.leaders_count)
+    await ctx.send(embed=embeds.leaders_embed(stats.store.leagues[code][0], field, leaders))
+
+# !compare command to show the season stats of several players side by side. (ex. !compare Haaland, Salah)
+@client.command(name='compare')
+async def compare_players(ctx, *, command_args=''):
+    """
+    Arguments:
+        command_args (string): Comma separated names of the players to compare
+    """
+    # Pick up stats ingested by another bot process
+    stats.store.reload()
+
+    player_names = [name for name in command_args.split(',') if name.strip()]
+    if not 2 <= len(player_names) <= config.compare_max_players:
+        msg = f"Please enter between 2 and {config.compare_max_players} player names, separated by commas."
+        await ctx.send(embed=embeds.simple_embed('Error', msg))
+        return
+
+    players = []
+    for name in player_names:
+        player_id = stats.store.find('players', name)
+        if player_id is None:
+            msg = f"No player named '{name.strip()}' was found in the loaded leagues. Please enter a valid name."
+            await ctx.send(embed=embeds.simple_embed('Error', msg))
+            return
+        player_name, position, club_id = stats.store.players[player_id]
+        club = stats.store.clubs.get(club_id, ('Unknown',))[0]
+        players.append((player_name, position, club, stats.store.player_stats(player_id)))
+
+    await ctx.send(embed=embeds.compare_embed(players))
+
+# !squad command to show the season stats of every player of a club. (ex. !squad Manchester City)
+@client.command(name='squad')
+async def get_squad(ctx, *, command_args=''):
+    """
+    Arguments:
+        command_args (string): Name of the club
+    """
+    # Pick up stats ingested by another bot process
+    stats.store.reload()
+
+    club_id = stats.store.find('clubs', command_args)
+    if club_id is None:
+        msg = "The club name is invalid or its league has not been loaded yet. Please enter a valid club name."
+        await ctx.send(embed=embeds.simple_embed('Error', msg))
+        return
+
+    await ctx.send(embed=embeds.squad_embed(stats.store.clubs[club_id][0], stats.store.squad(club_id)))
+
+# !follow command to post a club's new results and fixture changes in this channel. (ex. !follow Arsenal)
+@client.command(name='follow')
+async def follow_club(ctx, *, command_args=''):
+    """
+    Arguments:
+        command_args (string): Name of the club to follow
+    """
+    clubs = await scrape.search_club(command_args)
+
+    # Case 1: No results
+    if len(clubs) == 0:
+        msg = "The provided club name is invalid or does not exist. Please enter a valid club name."
+        await ctx.send(embed=embeds.simple_embed('Error', msg))
+        return
+
+    # Case 2: More than one result, the user selects one
+    club = clubs[0]
+    if len(clubs) > 1:
+        await ctx.send(embed=embeds.resulting_clubs_embed(clubs, command_args))
+
+        def check_input(message):
+            return message.author == ctx.author and message.channel == ctx.channel
+
+        try:
+            response = await client.wait_for('message', timeout=30, check=check_input)
+            index = int(response.content) - 1
+            if not 0 <= index < len(clubs):
+                raise ValueError
+            club = clubs[index]
+        except asyncio.TimeoutError:
+            msg = "Time limit exceeded. Please try the command again."
+            await ctx.send(embed=embeds.simple_embed('Error', msg))
+            return
+        except ValueError:
+            msg = "Incorrect response entered. Please try the command again."
+            await ctx.send(embed=embeds.simple_embed('Error', msg))
+            return
+
+    if follow.follows.follow(club, ctx.channel.id):
+        msg = f"This channel will be notified of {club.name}'s new results and fixture changes."
+    else:
+        msg = f"This channel already follows {club.name}."
+    await ctx.send(embed=embeds.simple_embed('Follow', msg))
+
+# !unfollow command to stop following a club (or every club, without a name) in this channel.
+@client.command(name='unfollow')
+async def unfollow_club(ctx, *, command_args=''):
+    removed = follow.follows.unfollow(ctx.channel.id, command_args)
+    if removed:
+        msg = f"This channel no longer follows {', '.join(removed)}."
+    else:
+        msg = "This channel does not follow a club with that name."
+    await ctx.send(embed=embeds.simple_embed('Unfollow', msg))
+
+# Below is a view letting the user of a slash command select one of several search results.
+class ResultSelect(discord.ui.View):
+    def __init__(self, user, labels):
+        super().__init__(timeout=30)
+        self.user = user
+        self.index = None
+
+        # Discord allows at most 25 options of up to 100 characters
+        options = [discord.SelectOption(label=label[:100], value=str(index)) for index, label in enumerate(labels[:25])]
+        self.select = discord.ui.Select(placeholder='Select a result', options=options)
+        self.select.callback = self.on_select
+        self.add_item(self.select)
+
+    async def interaction_check(self, interaction):
+        return interaction.user == self.user
+
+    async def on_select(self, interaction):
+        await interaction.response.defer()
+        self.index = int(self.select.values[0])
+        self.stop()
+
+# Below is a function that asks the user of a slash command to select a result, prefetching the top ones meanwhile.
+async def select_result(interaction, results, embed, labels, prefetcher):
+    """
+    Arguments:
+        - interaction (discord.Interaction) --> Deferred slash command interaction
+        - results (list) --> Search results (PlayerResult or ClubResult)
+        - embed (discord.Embed) --> Embed listing the results
+        - labels (list[str]) --> Select menu label of each result
+        - prefetcher (function) --> scrape.prefetch_player or scrape.prefetch_club
+    Returns: result --> Selected result, or None if the user did not select one in time
+    """
+    if len(results) == 1:
+        return results[0]
+
+    view = ResultSelect(interaction.user, labels)
+    await interaction.edit_original_response(embed=embed, view=view)
+    prefetches = scrape.prefetch(prefetcher, results)
+    selected = None
+    try:
+        await view.wait()
+        if view.index is None:
+            msg = "Time limit exceeded. Please try the command again."
+            await interaction.edit_original_response(embed=embeds.simple_embed('Error', msg), view=None)
+            return None
+        selected = view.index
+        return results[selected]
+    finally:
+        # The selected result's prefetch keeps running, the command displaying it joins its fetches
+        cancel_prefetches(prefetches, keep=selected)
+
+# /player command: defers right away, then edits a skeleton embed as the player's data arrives.
+@client.tree.command(name='player', description='Search the TransferMarkt profile of a player.')
+@app_commands.describe(name='Name of the player')
+@metrics.command_timed('slash_player')
+async def slash_player(interaction: discord.Interaction, name: str):
+    await interaction.response.defer()
+    players = await scrape.search_player(name)
+
+    if len(players) == 0:
+        msg = "The player name is invalid or does not exist. Please enter a valid name."
+        await interaction.edit_original_response(embed=embeds.simple_embed('Error', msg))
+        return
+
+    embed = embeds.resulting_players_embed(players, name)
+    embed.set_author(name=f"Multiple players found with the name '{name}'. Please select your player below.")
+    labels = [f'{player.name} ({player.position}) - {player.club}' for player in players]
+    player = await select_result(interaction, players, embed, labels, scrape.prefetch_player)
+    if player is None:
+        return
+
+    # More specific position information will be retrieved later
+    player_info = {'name': player.name, 'club': player.club, 'link': player.link}
+    async for player_info, player_stats_json, player_rumors in scrape.stream_stats(player_info):
+        embed = embeds.display_player(player_info, player_stats_json, player_rumors)
+        await interaction.edit_original_response(embed=embed, view=None)
+
+# /club command: defers right away, then edits a skeleton embed as the club's data arrives.
+@client.tree.command(name='club', description='Search the TransferMarkt profile of a team.')
+@app_commands.describe(name='Name of the club')
+@metrics.command_timed('slash_club')
+async def slash_club(interaction: discord.Interaction, name: str):
+    await interaction.response.defer()
+    clubs = await scrape.search_club(name)
+
+    if len(clubs) == 0:
+        msg = "The provided club name is invalid or does not exist. Please enter a valid club name."
+        await interaction.edit_original_response(embed=embeds.simple_embed('Error', msg))
+        return
+
+    embed = embeds.resulting_clubs_embed(clubs, name)
+    embed.set_author(name=f"Multiple clubs found with the name '{name}'. Please select your club below.")
+    club = await select_result(interaction, clubs, embed, [club.name for club in clubs], scrape.prefetch_club)
+    if club is None:
+        return
+
+    async for club_info in scrape.stream_club(club):
+        await interaction.edit_original_response(embed=embeds.display_club(club_info), view=None)
+
+# Run Discord Bot, as several shard processes when SHARD_PROCESSES is above 1, or only the JSON API with HEADLESS=1
+# (guarded, as parse workers started with PARSE_EXECUTOR=process import this module again)
+if __name__ == '__main__':
+    if config.headless:
+        api.main()
+    elif config.shard_processes > 1 and config.shard_ids is None:
+        shards.launch(TOKEN)
+    else:
+        client.run(TOKEN)
@@ -0,0 +1,439 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+# Local imports
+import config
+import scheduler
+
+# Set while a background refresh runs: entries close to expiry count as misses, recently
+# expired entries are not served, and lookups are left out of the hit/miss counters
+refreshing = contextvars.ContextVar('refreshing', default=False)
+
+# Below is a two-tier (memory + SQLite) cache for scraped transfermarkt data.
+class TieredCache:
+    """
+    Values are grouped by kind (ex. 'player_header', 'rumors'), and each kind has its own TTL.
+    The memory tier is an LRU bounded by the approximate json size of its entries, while the
+    disk tier persists every entry so that a restarted bot starts warm.
+    """
+    def __init__(self, path, max_bytes, ttls):
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.memory = OrderedDict()
+        self.counters = {}
+
+        # Disk tier (shared by every bot process, which wait up to cache_busy_timeout for each other's writes)
+        self.db = sqlite3.connect(path, timeout=config.cache_busy_timeout)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                        'kind TEXT, key TEXT, value TEXT, expires REAL, PRIMARY KEY (kind, key))')
+        self.db.execute('DELETE FROM cache WHERE expires < ?', (time.time() - config.cache_stale_ttl,))
+        self.db.commit()
+
+    # Below is a function to count hits and misses per kind.
+    def _count(self, kind, outcome):
+        if refreshing.get():
+            return
+        counter = self.counters.setdefault(kind, {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+        counter[outcome] += 1
+
+    # Below is a function to place an entry in the memory tier, evicting the least recently used.
+    def _remember(self, kind, key, value, size, expires):
+        self._forget((kind, key))
+        self.memory[(kind, key)] = (value, size, expires)
+        self.size += size
+        while self.size > self.max_bytes and self.memory:
+            self._forget(next(iter(self.memory)))
+
+    def _replace(self, kind, key, value, size, expires):
+        entry = self.memory.get((kind, key))
+        if entry is not None:
+            self.memory[(kind, key)] = (value, size, expires)
+            self.size += size - entry[1]
+            while self.size > self.max_bytes and self.memory:
+                self._forget(next(iter(self.memory)))
+
+    def _forget(self, memory_key):
+        entry = self.memory.pop(memory_key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def get(self, kind, key):
+        """
+        Arguments:
+            - kind (str) --> Type of data, used to look up its TTL
+            - key (str) --> Normalized query or transfermarkt ID
+        Returns: value --> Cached value, or None if missing/expired
+        """
+        now = time.time()
+        if refreshing.get():
+            now += config.refresh_ahead
+
+        # 1. Memory tier
+        entry = self.memory.get((kind, key))
+        if entry is not None:
+            if entry[2] > now:
+                self.memory.move_to_end((kind, key))
+                self._count(kind, 'memory_hits')
+                return entry[0]
+            self._forget((kind, key))
+
+        # 2. Disk tier
+        row = self.db.execute('SELECT value, expires FROM cache WHERE kind = ? AND key = ?',
+                              (kind, key)).fetchone()
+        if row is not None and row[1] > now:
+            value = json.loads(row[0])
+            self._remember(kind, key, value, len(row[0]), row[1])
+            self._count(kind, 'disk_hits')
+            return value
+
+        self._count(kind, 'misses')
+        return None
+
+    def set(self, kind, key, value):
+        """
+        Arguments:
+            - kind (str) --> Type of data, used to look up its TTL
+            - key (str) --> Normalized query or transfermarkt ID
+            - value --> json-serializable value to store
+        """
+        encoded = json.dumps(value)
+        expires = time.time() + self.ttls[kind]
+        if not refreshing.get():
+            self._remember(kind, key, value, len(encoded), expires)
+        else:
+            # Background writes (refresh, ingestion, follow polls) leave the memory tier to what commands
+            # use, and only replace a copy it already holds, without making it more recently used
+            self._replace(kind, key, value, len(encoded), expires)
+        self.db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (kind, key, encoded, expires))
+        self.db.commit()
+
+    def warm(self, entries):
+        """
+        Arguments: entries (list) --> (kind, key, value, expires) of a snapshot, least recently used first
+        Places unexpired entries in the memory tier, and writes back those the disk tier lost or holds an
+        older copy of (entries expired too long ago to be served stale are left out).
+        """
+        now = time.time()
+        for kind, key, value, expires in entries:
+            if expires < now - config.cache_stale_ttl:
+                continue
+            row = self.db.execute('SELECT expires FROM cache WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+            # A newer copy on disk (ex. written by another bot process) is read on demand instead
+            if row is not None and row[0] > expires:
+                continue
+            encoded = json.dumps(value)
+            if row is None or row[0] < expires:
+                self.db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (kind, key, encoded, expires))
+            if expires > now:
+                self._remember(kind, key, value, len(encoded), expires)
+        self.db.commit()
+
+    def get_stale(self, kind, key):
+        """
+        Arguments:
+            - kind (str) --> Type of data
+            - key (str) --> Normalized query or transfermarkt ID
+        Returns: value --> Last stored value even if expired (kept for config.cache_stale_ttl), or None
+        """
+        entry = self.memory.get((kind, key))
+        if entry is not None:
+            return entry[0]
+        row = self.db.execute('SELECT value FROM cache WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_entry(self, kind, key):
+        """
+        Arguments:
+            - kind (str) --> Type of data
+            - key (str) --> Normalized query or transfermarkt ID
+        Returns: entry (tuple) --> (value, expires) of the last stored value even if expired, or None
+        """
+        entry = self.memory.get((kind, key))
+        if entry is not None:
+            return entry[0], entry[2]
+        row = self.db.execute('SELECT value, expires FROM cache WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return (json.loads(row[0]), row[1]) if row is not None else None
+
+    def get_recent(self, kind, key):
+        """
+        Arguments:
+            - kind (str) --> Type of data
+            - key (str) --> Normalized query or transfermarkt ID
+        Returns: value --> Value that expired less than config.cache_revalidate_window of its TTL ago, or None
+        """
+        if refreshing.get():
+            return None
+        row = self.db.execute('SELECT value, expires FROM cache WHERE kind = ? AND key = ?',
+                              (kind, key)).fetchone()
+        if row is None or row[1] + self.ttls[kind] * config.cache_revalidate_window < time.time():
+            return None
+        return json.loads(row[0])
+
+    def values(self, kind):
+        """
+        Arguments: kind (str) --> Type of data
+        Returns: values (generator) --> (value, time stored) of every unexpired entry of that kind, oldest first
+        """
+        rows = self.db.execute('SELECT value, expires FROM cache WHERE kind = ? AND expires > ? ORDER BY expires',
+                               (kind, time.time())).fetchall()
+        for value, expires in rows:
+            yield json.loads(value), expires - self.ttls[kind]
+
+    def expire(self, kind, key):
+        """
+        Arguments:
+            - kind (str) --> Type of data
+            - key (str) --> Normalized query or transfermarkt ID
+        Marks an entry as expired, so the next lookup re-fetches it (it is still served by get_stale).
+        """
+        now = time.time()
+        self._forget((kind, key))
+        self.db.execute('UPDATE cache SET expires = MIN(expires, ?) WHERE kind = ? AND key = ?', (now, kind, key))
+        self.db.commit()
+
+    def fresh(self, kind, key):
+        """
+        Arguments:
+            - kind (str) --> Type of data
+            - key (str) --> Normalized query or transfermarkt ID
+        Returns: fresh (bool) --> True if get would return the entry (without counting a lookup)
+        """
+        remaining = self.expires_in(kind, key)
+        return remaining is not None and remaining > (config.refresh_ahead if refreshing.get() else 0)
+
+    def expires_in(self, kind, key):
+        """
+        Arguments:
+            - kind (str) --> Type of data
+            - key (str) --> Normalized query or transfermarkt ID
+        Returns: seconds (float) --> Time until the entry expires (negative once expired), or None if not stored
+        """
+        entry = self.memory.get((kind, key))
+        if entry is not None:
+            return entry[2] - time.time()
+        row = self.db.execute('SELECT expires FROM cache WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return row[0] - time.time() if row is not None else None
+
+    def stats(self):
+        """
+        Returns: stats (dict) --> Hit/miss counters per kind, plus memory tier usage
+        """
+        return {'kinds': {kind: dict(counter) for kind, counter in self.counters.items()},
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.size}
+
+# Below is a function used to normalize search queries into cache keys.
+def normalize(query):
+    return ' '.join(query.lower().split())
+
+# Below is a table of the fetches in flight in every bot process, kept next to the shared cache.
+class SharedFlights:
+    """
+    A process claims a (kind, key) before fetching it. Other processes wanting the same key wait
+    for the claim to be released, then read the result from the shared cache instead of fetching
+    it again. Claims older than shared_flight_timeout (ex. left by a crashed process) are ignored.
+    """
+    def __init__(self, path):
+        # Autocommit, so a claim is visible to the other processes right away
+        self.db = sqlite3.connect(path, timeout=config.cache_busy_timeout, isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS flights ('
+                        'kind TEXT, key TEXT, owner INTEGER, started REAL, PRIMARY KEY (kind, key))')
+        self.owner = os.getpid()
+        self.counters = {'claimed': 0, 'waited': 0}
+
+    def claim(self, kind, key):
+        """
+        Returns: claimed (bool) --> False if another process is already fetching the key
+        """
+        now = time.time()
+        claimed = self.db.execute('INSERT INTO flights VALUES (?, ?, ?, ?) ON CONFLICT (kind, key) DO UPDATE '
+                                  'SET owner = excluded.owner, started = excluded.started WHERE started < ?',
+                                  (kind, key, self.owner, now, now - config.shared_flight_timeout)).rowcount == 1
+        self.counters['claimed' if claimed else 'waited'] += 1
+        return claimed
+
+    def release(self, kind, key):
+        self.db.execute('DELETE FROM flights WHERE kind = ? AND key = ? AND owner = ?', (kind, key, self.owner))
+
+    async def wait(self, kind, key):
+        deadline = time.monotonic() + config.shared_flight_timeout
+        while time.monotonic() < deadline and \
+                self.db.execute('SELECT 1 FROM flights WHERE kind = ? AND key = ?', (kind, key)).fetchone():
+            await asyncio.sleep(config.shared_flight_poll)
+
+    def stats(self):
+        return dict(self.counters)
+
+# Shared with the other bot processes when running as several shard processes
+flights = SharedFlights(config.cache_path) if config.rate_processes > 1 else None
+
+# Below is a function that runs a fetcher unless another bot process is already running it.
+async def shared_fetch(kind, key, fetcher, cached_kinds):
+    """
+    Arguments: same as single_flight
+    Returns: value --> Result of the fetcher
+    """
+    if flights is None or all(store.fresh(cached_kind, key) for cached_kind in cached_kinds):
+        # Answered from the cache: no claim (a write shared by every process) is needed
+        return await fetcher()
+    if not flights.claim(kind, key):
+        # Usually answered from the cache the other process just filled
+        await flights.wait(kind, key)
+        return await fetcher()
+    try:
+        return await fetcher()
+    finally:
+        flights.release(kind, key)
+
+# In-flight fetches, keyed by (kind, key, refreshing), shared by concurrent callers
+in_flight = {}
+
+# Number of callers waiting on each in-flight fetch
+waiters = {}
+
+# Below is a function that removes a finished (or abandoned) fetch, unless a newer one replaced it.
+def forget_flight(flight_key, task):
+    if in_flight.get(flight_key) is task:
+        del in_flight[flight_key]
+
+# Below is a function that lets concurrent callers with the same key share one fetch-and-parse.
+async def single_flight(kind, key, fetcher, cached_kinds=None):
+    """
+    Arguments:
+        - kind (str) --> Type of data being fetched
+        - key (str) --> Normalized query or transfermarkt ID
+        - fetcher (function) --> Coroutine function performing the fetch-and-parse
+        - cached_kinds (tuple) --> Cache kinds the fetcher stores its result under (defaults to kind)
+    Returns: value --> Result of the single shared fetcher call
+    """
+    # Commands never wait on a background refresh of the same key (it runs at a lower priority)
+    flight_key = (kind, key, refreshing.get())
+    task = in_flight.get(flight_key)
+    if task is None:
+        task = asyncio.ensure_future(shared_fetch(kind, key, fetcher, cached_kinds or (kind,)))
+        in_flight[flight_key] = task
+        task.add_done_callback(lambda _: forget_flight(flight_key, task))
+
+    # Shield the shared task so that one caller timing out does not cancel it for the others
+    waiters[flight_key] = waiters.get(flight_key, 0) + 1
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # The last caller to give up cancels the fetch itself (ex. a prefetch nobody needs any more)
+        if waiters[flight_key] == 1:
+            task.cancel()
+            forget_flight(flight_key, task)
+        raise
+    finally:
+        waiters[flight_key] -= 1
+        if not waiters[flight_key]:
+            del waiters[flight_key]
+
+# Below is a decorator applying single_flight to a scrape function, keyed on its first argument.
+def coalesce(kind, cached_kinds=None):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(key, *args):
+            return await single_flight(kind, key, lambda: func(key, *args), cached_kinds)
+        return wrapper
+    return decorator
+
+# Below is a class tracking how often each player and club is looked up, decaying over time.
+class Popularity:
+    def __init__(self, half_life, capacity):
+        self.half_life = half_life
+        self.capacity = capacity
+        self.entries = {}
+
+    def _score(self, entry, now):
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    def record(self, kind, key, *args):
+        """
+        Arguments:
+            - kind (str) --> 'player' or 'club'
+            - key (str) --> Transfermarkt ID
+            - args --> Arguments needed to refresh the entry later
+        """
+        if refreshing.get():
+            return
+        now = time.monotonic()
+        entry = self.entries.get((kind, key))
+        score = self._score(entry, now) + 1 if entry is not None else 1
+        self.entries[(kind, key)] = (score, now, args)
+
+        # Forget the least popular entry once the tracker is full
+        if len(self.entries) > self.capacity:
+            del self.entries[min(self.entries, key=lambda k: self._score(self.entries[k], now))]
+
+    def restore(self, kind, key, score, args):
+        """
+        Arguments: same as record, plus score (float) --> Decayed lookup count carried over from a snapshot
+        """
+        now = time.monotonic()
+        entry = self.entries.get((kind, key))
+        if entry is not None:
+            score += self._score(entry, now)
+        self.entries[(kind, key)] = (score, now, args)
+
+    def ranked(self):
+        """
+        Returns: ranked (list) --> (kind, key, score, args) of every tracked entry, most looked up first
+        """
+        now = time.monotonic()
+        scored = sorted(((self._score(entry, now), memory_key) for memory_key, entry in self.entries.items()),
+                        reverse=True)
+        return [(*memory_key, score, self.entries[memory_key][2]) for score, memory_key in scored]
+
+    def hot(self, minimum):
+        """
+        Arguments: minimum (float) --> Decayed lookup count an entry must exceed
+        Returns: hot (list) --> (kind, key, args) of popular entries, most looked up first
+        """
+        return [(kind, key, args) for kind, key, score, args in self.ranked() if score > minimum]
+
+# Revalidations running in the background, keyed by (function name, arguments)
+revalidating = {}
+
+# Shared by revalidations and the refresher, so background fetches stay bounded
+background_slots = asyncio.Semaphore(config.refresh_concurrency)
+
+# Below is a function that runs a scrape function as a background refresh.
+async def background(func, *args):
+    """
+    Arguments:
+        - func (function) --> Coroutine function to run, ex. scrape.get_stats
+        - args --> Its arguments
+    Returns: result --> Its result, or None if the refresh failed (stale entries stay in place)
+    """
+    async with background_slots:
+        refreshing.set(True)
+        scheduler.current_priority.set(scheduler.BACKGROUND)
+        try:
+            return await func(*args)
+        except Exception:
+            return None
+
+# Below is a function that re-fetches a stale entry in the background while it is being served.
+def revalidate(func, *args):
+    key = (func.__qualname__, args)
+    if key in revalidating:
+        return
+    task = asyncio.ensure_future(background(func, *args))
+    revalidating[key] = task
+    task.add_done_callback(lambda _: revalidating.pop(key, None))
+
+# Shared cache used by the scrape module
+store = TieredCache(config.cache_path, config.cache_memory_bytes, config.cache_ttl)
+
+# Lookup counts of players and clubs, used by the background refresher
+popularity = Popularity(config.refresh_half_life, config.refresh_track_max)
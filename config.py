@@ -1,7 +1,183 @@
+import os
+
 # BeautifulSoup helper variables
 headers = {'User-Agent': 
            'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/47.0.2526.106 Safari/537.36'}
 
-# Transfermarkt links
-tm_main = 'https://www.transfermarkt.us'
+# Transfermarkt links (TM_BASE_URL can point the bot at a local stand-in, ex. benchmarks/stub_server.py)
+tm_main = os.getenv('TM_BASE_URL', 'https://www.transfermarkt.us')
 tm_search = tm_main + '/schnellsuche/ergebnis/schnellsuche?query='
+tm_ceapi = tm_main + '/ceapi'
+
+# HTTP connection pool settings shared by every scrape function
+http_pool_size = 20
+http_keepalive = 30
+
+# Scrape cache settings. TTLs (seconds) are set per type of data:
+# slow-changing data (image urls, positions, club links) is kept long, volatile data short.
+cache_path = 'sonny_cache.sqlite3'
+cache_memory_bytes = 32 * 1024 * 1024
+cache_ttl = {
+    'search': 24 * 3600,
+    'player_header': 7 * 24 * 3600,
+    'player_status': 30 * 60,
+    'performance': 60 * 60,
+    'rumors': 30 * 60,
+    'club_header': 7 * 24 * 3600,
+    'club_form': 60 * 60,
+    'next_matches': 15 * 60,
+    # Parse results by page hash, and ETag/Last-Modified validators by URL (for conditional requests)
+    'parsed': 24 * 3600,
+    'validators': 24 * 3600,
+}
+
+# Time (seconds) a bot process waits for another one's write to the cache database
+cache_busy_timeout = 5
+
+# Expired entries are kept this long (seconds) so they can be served while transfermarkt is failing
+cache_stale_ttl = 7 * 24 * 3600
+
+# Outbound rate limits as (requests per second, burst), per host and per endpoint class
+rate_limit_host = (6, 12)
+rate_limit_class = {'html': (3, 6), 'ceapi': (5, 10)}
+
+# Retries of throttled or failed requests, with exponential backoff and jitter (seconds)
+http_max_retries = 3
+http_backoff_base = 0.5
+http_backoff_cap = 30
+
+# Adaptive per-endpoint timeouts (seconds), derived from recent latency percentiles
+latency_window = 200
+latency_min_samples = 20
+timeout_default = {'search': 5, 'profile': 5, 'spielplan': 5, 'league': 5, 'squad': 5,
+                   'performance': 2, 'rumors': 2, 'next_matches': 2}
+timeout_min = 0.5
+timeout_max = 10
+timeout_multiplier = 1.5
+
+# Hedged requests: a second attempt is sent when the first is slower than the endpoint's p95
+hedge_requests = True
+hedge_endpoints = {'performance', 'rumors', 'next_matches'}
+hedge_percentile = 95
+
+# Circuit breaker: consecutive failures before an endpoint is skipped, and for how long (seconds)
+breaker_threshold = 5
+breaker_cooldown = 30
+
+# Local Prometheus-style metrics endpoint (http://127.0.0.1:<port>/metrics), disabled with METRICS_PORT=0
+metrics_port = int(os.getenv('METRICS_PORT', '9108'))
+
+# Opt-in sampling profiler: fraction of commands run under cProfile, and how many of the slowest to keep
+profile_sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+profile_keep = 10
+profile_dir = 'profiles'
+
+# Stale-while-revalidate: entries that expired less than this fraction of their TTL ago are served
+# instantly while they are re-fetched in the background
+cache_revalidate_window = 1.0
+
+# Background refresh of popular players and clubs: every refresh_interval seconds, up to refresh_budget
+# entries looked up more than refresh_min_score times (counts halve every refresh_half_life seconds)
+# are re-fetched if their cached data expires within refresh_ahead seconds
+refresh_interval = 60
+refresh_ahead = 5 * 60
+refresh_budget = 10
+refresh_concurrency = 2
+refresh_min_score = 2
+refresh_half_life = 6 * 3600
+refresh_track_max = 2000
+
+# Speculative prefetch of the top search results while the user picks one
+prefetch_candidates = 3
+prefetch_concurrency = 2
+
+# HTML parsing executor: 'thread', 'process', or '' to parse on the event loop. At most
+# parse_queue_limit pages are handed to the workers at once, later pages wait their turn.
+parse_executor = os.getenv('PARSE_EXECUTOR', 'thread')
+parse_workers = 2
+parse_queue_limit = 16
+
+# Player profiles are downloaded in chunks of this size and parsed incrementally, stopping once
+# every field has been found. Set stream_profiles to False to download and parse whole pages.
+stream_profiles = True
+stream_chunk_size = 16 * 1024
+
+# Local name index: a search that is not cached is answered locally when one name contains at least
+# name_index_min_score of the query's trigrams, is at least name_index_min_similarity similar to the whole
+# query (so a first or last name alone is never enough), and beats the next name by name_index_margin.
+# When transfermarkt finds nothing, up to name_index_suggestions names above name_index_suggest_score
+# are offered instead. The index keeps the names seen in the last day of searches (cache_ttl['search']),
+# at most name_index_max of them.
+name_index_min_score = 0.85
+name_index_min_similarity = 0.8
+name_index_margin = 0.2
+name_index_suggest_score = 0.6
+name_index_suggestions = 10
+name_index_max = 50000
+
+# League ingestion into the local stats store: every ingest_interval seconds, the table of each league
+# in ingest_leagues is read, and only clubs that played since the last pass have their squad and their
+# players' performance re-read, with at most ingest_concurrency requests at a time
+stats_path = 'sonny_stats.npz'
+ingest_leagues = ['/premier-league/startseite/wettbewerb/GB1']
+ingest_interval = 6 * 3600
+ingest_concurrency = 4
+
+# Commands answered from the local stats store: players listed by !leaders, and players compared
+# at once by !compare (each takes 4 of the 25 fields of an embed)
+leaders_count = 10
+compare_max_players = 6
+
+# Stages listed by !stats (the slowest by p95)
+stats_embed_stages = 15
+
+# Followed clubs (!follow): each club is polled every follow_interval seconds, and follow_result_delay
+# seconds after each kickoff. Clubs due within follow_batch_window seconds are polled together, and a
+# failed poll is retried after follow_retry seconds. The bot checks for due clubs every follow_tick seconds.
+follow_path = 'sonny_follows.sqlite3'
+follow_interval = 3 * 3600
+follow_result_delay = 150 * 60
+follow_batch_window = 5 * 60
+follow_retry = 10 * 60
+follow_tick = 60
+
+# Sharding: with SHARD_PROCESSES above 1, bot.py starts that many bot processes, each running an equal
+# share of SHARD_COUNT shards (Discord's recommended count when unset). They share the scrape cache
+# (cache_path) and a table of fetches in flight, and split the outbound rate limits evenly. Each process
+# refreshes the players and clubs looked up through its own shards, while only the first one runs the
+# ingestion and follow loops and registers the slash commands. A process waits up to shared_flight_timeout
+# seconds for another one's fetch, checking every shared_flight_poll seconds. On shutdown, the launcher
+# gives the processes shard_shutdown_timeout seconds to close (and save their snapshot) before killing them.
+shard_processes = int(os.getenv('SHARD_PROCESSES', '1'))
+shard_count = int(os.getenv('SHARD_COUNT', '0')) or None
+shard_ids = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id] or None
+process_index = int(os.getenv('SHARD_PROCESS', '0'))
+shard_shutdown_timeout = 30
+
+# Processes sharing transfermarkt's request budget and the table of fetches in flight: the bot's shard
+# processes by default. Set RATE_PROCESSES one higher in every process when a headless API (HEADLESS=1)
+# runs beside the bot, so that together they stay within rate_limit_host and rate_limit_class.
+rate_processes = int(os.getenv('RATE_PROCESSES', '0')) or shard_processes
+shared_flight_timeout = 15
+shared_flight_poll = 0.05
+
+# Local JSON API over the scrape layer (api.py): served by the bot on API_PORT (plus the process index)
+# when set, sharing its cache, fetches in flight and rate limiter. With HEADLESS=1, bot.py serves only
+# the API (on API_PORT, or api_port_default), without connecting to Discord. Batch calls resolve at most
+# api_batch_max IDs, api_batch_concurrency at a time. The headless API serves its metrics on
+# API_METRICS_PORT, by default the port just below metrics_port (the bot's processes take metrics_port upwards).
+api_host = os.getenv('API_HOST', '127.0.0.1')
+api_port = int(os.getenv('API_PORT', '0'))
+api_port_default = 8110
+api_metrics_port = int(os.getenv('API_METRICS_PORT', '0')) or (metrics_port - 1 if metrics_port else 0)
+headless = os.getenv('HEADLESS', '0') == '1'
+api_batch_max = 100
+api_batch_concurrency = 8
+
+# Startup snapshot: at most snapshot_entries cache entries (of the most looked up players and clubs, then of
+# the latest searches), and the lookup counts of the background refresher, written at shutdown and every snapshot_interval
+# seconds (so a crash restart also starts warm), and loaded before the bot connects to Discord
+snapshot_path = f'sonny_snapshot-{process_index}.json.gz'
+snapshot_entries = 2000
+snapshot_interval = 10 * 60
+snapshot_compression = 6
@@ -2,9 +2,16 @@ import discord
 from datetime import datetime
 
 import config
+import metrics
+
+# The stats store (and numpy) is imported by the first stats command or ingestion, not at startup
+stats = metrics.lazy_import('stats')
 
 transfermarkt_footer = "Data obtained from transfermarkt.us"
 
+# Shown in place of data that is still being retrieved (slash commands edit their embed as it arrives)
+loading = "Loading..."
+
 # Below is a function for initializing embed color.
 def embed_setup(r, g, b):
     embed = discord.Embed(
@@ -26,26 +33,74 @@ def command_help():
     embed.add_field(name='!hello', value = "Test command to check whether or not Sonny Bot is up.", inline=False)
     embed.add_field(name='!player [player_name]', value = "Search the TransferMarkt profile of a player.", inline=False)
     embed.add_field(name='!club [club_name]', value = "Search the TransferMarkt profile of a team.", inline=False)
+    embed.add_field(name='/player and /club', value = "Same as above, showing results as soon as they arrive.", inline=False)
+    embed.add_field(name='!leaders [league] [stat]', value = "Top players of a league in goals, assists, apps, starts, cs or conceded.", inline=False)
+    embed.add_field(name='!compare [player], [player], ...', value = "Compare the season stats of several players.", inline=False)
+    embed.add_field(name='!squad [club_name]', value = "Season stats of every player of a club.", inline=False)
+    embed.add_field(name='!follow [club_name]', value = "Post a club's new results and fixture changes in this channel.", inline=False)
+    embed.add_field(name='!unfollow [club_name]', value = "Stop following a club in this channel (or every club, without a name).", inline=False)
+    return embed
+
+# Discord refuses embeds with a field value longer than this
+field_value_limit = 1024
+
+# Below is a function to produce an embed for the admin-only !stats command.
+def stats_embed(histograms, cache_stats, scheduler_stats):
+    """
+    Arguments:
+        - histograms (dict) --> metrics.histograms, keyed by (command, stage)
+        - cache_stats (dict) --> cache.store.stats()
+        - scheduler_stats (dict) --> scheduler.outbound.stats()
+    Returns: embed (discord.Embed) --> Per-stage latencies, cache hit rates and queue depth
+    """
+    embed = embed_setup(255, 255, 255)
+
+    # Only the slowest stages by p95 are listed, as long as every column fits in a field
+    slowest = sorted(histograms.items(), key=lambda item: item[1].percentile(95), reverse=True)
+    stages = {'stage': "", 'count': "", 'latency': ""}
+    listed = 0
+    for (command, stage), histogram in slowest[:config.stats_embed_stages]:
+        line = f'{command}/{stage}\n'
+        if len(stages['stage']) + len(line) > field_value_limit:
+            break
+        listed += 1
+        stages['stage'] += line
+        stages['count'] += f'{histogram.total}\n'
+        stages['latency'] += f'{histogram.percentile(50) * 1000:.0f} / {histogram.percentile(95) * 1000:.0f}\n'
+
+    embed.add_field(name=f'Stage (slowest {listed} of {len(histograms)})',
+                    value=stages['stage'] or '-', inline=True)
+    embed.add_field(name='Count', value=stages['count'] or '-', inline=True)
+    embed.add_field(name='p50 / p95 (ms)', value=stages['latency'] or '-', inline=True)
+
+    hits = ""
+    for kind, counter in sorted(cache_stats['kinds'].items()):
+        lookups = sum(counter.values())
+        hit_rate = (counter.get('memory_hits', 0) + counter.get('disk_hits', 0)) / lookups if lookups else 0
+        hits += f'{kind}: {hit_rate:.0%} of {lookups}\n'
+    embed.add_field(name='Cache Hit Rate', value=hits or '-', inline=True)
+    embed.add_field(name='Request Queue',
+                    value=f"Depth: {scheduler_stats['queue_depth']}\n"
+                          f"Wait p50: {scheduler_stats['wait_ms_p50']:.0f} ms\n"
+                          f"Retries: {scheduler_stats['retries']}", inline=True)
+
+    embed.timestamp = datetime.now()
     return embed
 
 # Below is a function to produce an embed, displaying all resulting players upon searching.
-def resulting_players_embed(df, player_name):
+@metrics.timed('resulting_players_embed')
+def resulting_players_embed(players, player_name):
     embed = embed_setup(255, 255, 255)
     embed.set_author(
         name = f"Multiple players found with the name '{player_name}'. Please type the command [index] to select your player. \n")
     
     players_dict = {'index': "", 'names': "", 'clubs': "", 'positions': ""}
 
-    for ind in df.index:
-        # Extract player name, position
-        name = df['Name'][ind]
-        position = df['Position'][ind]
-        club = df['Club'][ind]
-
-        # Update dictionary
+    for ind, player in enumerate(players):
+        # Update dictionary with player name, position, club
         players_dict['index'] += f'{ind+1}\n'
-        players_dict['names'] += f'{name} ({position})\n'
-        players_dict['clubs'] += f'{club}\n'
+        players_dict['names'] += f'{player.name} ({player.position})\n'
+        players_dict['clubs'] += f'{player.club}\n'
     
     embed.add_field(name='Index', value=players_dict['index'], inline=True)
     embed.add_field(name='Name (Position)', value=players_dict['names'], inline=True)
@@ -56,19 +111,18 @@ def resulting_players_embed(df, player_name):
     return embed
 
 # Below is a function to produce an embed, displaying all resulting clubs upon searching.
-def resulting_clubs_embed(df, club_name):
+@metrics.timed('resulting_clubs_embed')
+def resulting_clubs_embed(clubs, club_name):
     embed = embed_setup(255, 255, 255)
     embed.set_author(
         name = f"Multiple clubs found with the name '{club_name}'. Please type the command [index] to select your club. \n")
     
     clubs_dict = {'index': "", 'clubs': ""}
 
-    for ind in df.index:
-        club = df['Club'][ind]
-
+    for ind, club in enumerate(clubs):
         # Update clubs_dict
         clubs_dict['index'] += f'{ind+1}\n'
-        clubs_dict['clubs'] += f'{club}\n'
+        clubs_dict['clubs'] += f'{club.name}\n'
     
     embed.add_field(name='Index', value=clubs_dict['index'], inline=True)
     embed.add_field(name='Club', value=clubs_dict['clubs'], inline=True)
@@ -78,33 +132,50 @@ def resulting_clubs_embed(df, club_name):
     return embed
 
 # Below is a function to display overall player information.
+@metrics.timed('display_player')
 def display_player(player_data, player_stats_json, player_rumors):
-    
+    pending = player_data.get('pending', ())
+
     # Set up embed
     embed = embed_setup(255, 255, 255)
     embed.set_author(name = f"⚽{player_data['name']} (2023-24 Stats)")
-    embed.set_thumbnail(url = player_data['image_url'])
 
-    # 1. Display player club data
-    club = f"[{player_data['club']}]({config.tm_main + player_data['clublink']})"
-    embed.add_field(name='Current Club', value = club, inline=True)
-    
+    # 1. Display player club data (the image and club link come from the profile page)
+    if 'profile' in pending:
+        embed.add_field(name='Current Club', value = player_data['club'], inline=True)
+    else:
+        embed.set_thumbnail(url = player_data['image_url'])
+        club = f"[{player_data['club']}]({config.tm_main + player_data['clublink']})"
+        embed.add_field(name='Current Club', value = club, inline=True)
+
     # 2. Display player position data
-    embed.add_field(name='Position', value = player_data['position'], inline=False)
+    embed.add_field(name='Position', value = player_data.get('position', loading), inline=False)
 
     # 3. Display player statistics for the current season
     # Displayed information is different depending on player position.
-    if player_data['position'] == 'Goalkeeper':
+    if 'profile' in pending or 'performance' in pending:
+        embed.add_field(name='Season Stats', value=loading, inline=False)
+
+    elif 'performance' in player_data.get('unavailable', ()):
+        embed.add_field(name='Season Stats', value="Currently unavailable", inline=False)
+
+    elif player_data['position'] == 'Goalkeeper':
         embed = display_goalkeeper(player_data['club'], player_stats_json, embed)
 
     else:
         embed = display_outfield(player_data['club'], player_stats_json, embed)
     
     # 4. Add player status, and line break
-    embed.add_field(name='Availability Status', value=player_data['status'], inline=False)
+    embed.add_field(name='Availability Status', value=player_data.get('status', loading), inline=False)
 
     # 5. Display transfer rumors
-    if player_rumors:
+    if 'rumors' in pending:
+        embed.add_field(name='Transfer Rumors', value=loading, inline=False)
+
+    elif 'rumors' in player_data.get('unavailable', ()):
+        embed.add_field(name='Transfer Rumors', value="Currently unavailable", inline=False)
+
+    elif player_rumors:
         embed.add_field(name='Team (Transfer Rumors)', value=player_rumors['teams'], inline=True)
         embed.add_field(name='Probability', value=player_rumors['probability'], inline=True)
     
@@ -120,7 +191,8 @@ def display_player(player_data, player_stats_json, player_rumors):
     return embed
 
 # Below is a function to display goalkeeper performance metrics.
-def display_goalkeeper(club, player_stats_json, embed):
+# (The first column lists tournaments, or players when name is given, ex. for !squad.)
+def display_goalkeeper(club, player_stats_json, embed, name='Tournament'):
     
     # Initialize strings for display
     pl_tournament, pl_apps, pl_conc_goals = "", "", ""
@@ -139,7 +211,7 @@ def display_goalkeeper(club, player_stats_json, embed):
     
     # Set-up embed
     if club != 'Without Club':
-        embed.add_field(name='Tournament', value=pl_tournament, inline=True)
+        embed.add_field(name=name, value=pl_tournament, inline=True)
         embed.add_field(name='Apps (CS)', value=pl_apps, inline=True)
         embed.add_field(name='Gls. Conceded', value=pl_conc_goals, inline=True)
     else:
@@ -147,7 +219,7 @@ def display_goalkeeper(club, player_stats_json, embed):
     return embed
 
 # Below is a function to display defender performance metrics.
-def display_outfield(club, player_stats_json, embed):
+def display_outfield(club, player_stats_json, embed, name='Tournament'):
     
     # Initialize strings for display
     pl_tournament, pl_apps, starting_per = "", "", ""
@@ -166,33 +238,142 @@ def display_outfield(club, player_stats_json, embed):
     
     # Set-up embed
     if club != 'Without Club':
-        embed.add_field(name='Tournament', value=pl_tournament, inline=True)
+        embed.add_field(name=name, value=pl_tournament, inline=True)
         embed.add_field(name='Apps (G/A)', value=pl_apps, inline=True)
         embed.add_field(name='SE (%)', value=starting_per, inline=True)
     else:
         pass
     return embed
 
+# Below is a function to display the league leaders of one stat, from the local stats store.
+@metrics.timed('leaders_embed')
+def leaders_embed(league, field, leaders):
+    """
+    Arguments:
+        - league (str) --> League name
+        - field (str) --> Stat the players are ranked by, ex. 'goalsScored'
+        - leaders (list[dict]) --> stats.store.leaders rows, best first
+    Returns: embed (discord.Embed) --> Leaders listed in the same columns as a player's season stats
+    """
+    embed = embed_setup(255, 255, 255)
+    embed.set_author(name = f"⚽{league} Leaders: {stats.stat_labels[field]} (2023-24 Stats)")
+    if not leaders:
+        embed.add_field(name='Player', value="None", inline=False)
+    elif field in stats.goalkeeper_fields:
+        embed = display_goalkeeper(league, leaders, embed, name='Player')
+    else:
+        embed = display_outfield(league, leaders, embed, name='Player')
+
+    embed.timestamp = datetime.now()
+    embed.set_footer(text=transfermarkt_footer)
+    return embed
+
+# Below is a function to display the season stats of a club's squad, from the local stats store.
+@metrics.timed('squad_embed')
+def squad_embed(club, squad):
+    """
+    Arguments:
+        - club (str) --> Club name
+        - squad (list[dict]) --> stats.store.squad rows
+    Returns: embed (discord.Embed) --> Goalkeepers and outfield players, in separate column layouts
+    """
+    embed = embed_setup(255, 255, 255)
+    embed.set_author(name = f"⚽{club} Squad (2023-24 Stats, all competitions)")
+
+    goalkeepers = [player for player in squad if player['position'] == 'Goalkeeper']
+    outfield = [player for player in squad if player['position'] != 'Goalkeeper']
+    if not squad:
+        embed.add_field(name='Player', value="None", inline=False)
+    if goalkeepers:
+        embed = display_goalkeeper(club, goalkeepers, embed, name='Goalkeeper')
+    if outfield:
+        embed = display_outfield(club, outfield, embed, name='Player')
+
+    embed.timestamp = datetime.now()
+    embed.set_footer(text=transfermarkt_footer)
+    return embed
+
+# Below is a function to display the season stats of several players next to each other.
+@metrics.timed('compare_embed')
+def compare_embed(players):
+    """
+    Arguments: players (list[tuple]) --> (name, position, club, player_stats_json) of each player
+    Returns: embed (discord.Embed) --> One section per player, laid out like display_player's season stats
+    """
+    embed = embed_setup(255, 255, 255)
+    embed.set_author(name = "⚽Player Comparison (2023-24 Stats)")
+
+    for name, position, club, player_stats_json in players:
+        embed.add_field(name=name, value=f"{position} - {club}", inline=False)
+        if not player_stats_json:
+            embed.add_field(name='Season Stats', value="None", inline=False)
+        elif position == 'Goalkeeper':
+            embed = display_goalkeeper(club, player_stats_json, embed)
+        else:
+            embed = display_outfield(club, player_stats_json, embed)
+
+    embed.timestamp = datetime.now()
+    embed.set_footer(text=transfermarkt_footer)
+    return embed
+
+# Below is a function to display what changed about a followed club since it was last polled.
+def follow_update_embed(club_name, changes):
+    """
+    Arguments:
+        - club_name (str) --> Name of the followed club
+        - changes (dict) --> follow.diff result, with 'past_results' and/or 'fixtures' as (old, new)
+    Returns: embed (discord.Embed) --> New league form and/or updated next fixtures
+    """
+    embed = embed_setup(255, 255, 255)
+    embed.set_author(name = f"⚽{club_name} Update")
+
+    if 'past_results' in changes:
+        old, new = changes['past_results']
+        embed.add_field(name='Domestic League Form', value = f"{old or '-'} → {new or '-'}", inline=False)
+
+    if 'fixtures' in changes:
+        fixtures = {'opponents': "", 'leagues': "", 'times': ""}
+        for kickoff, opponent, league in changes['fixtures'][1]:
+            fixtures['opponents'] += f"{opponent}\n"
+            fixtures['leagues'] += f"{league}\n"
+            fixtures['times'] += f"{datetime.utcfromtimestamp(kickoff)}\n"
+        embed.add_field(name='Next Matches (Updated)', value = fixtures['opponents'] or "None", inline=True)
+        embed.add_field(name='League', value = fixtures['leagues'] or "-", inline=True)
+        embed.add_field(name='Match Time', value = fixtures['times'] or "-", inline=True)
+
+    embed.timestamp = datetime.now()
+    embed.set_footer(text=transfermarkt_footer)
+    return embed
+
 # Below is a function to display overall team information.
-def display_club(club_info, df):
+@metrics.timed('display_club')
+def display_club(club_info):
+    pending = club_info.get('pending', ())
+
     embed = embed_setup(255, 255, 255)
     embed.set_author(name = f"⚽{club_info['name']} (2023-24 Stats)")
-    embed.set_thumbnail(url = club_info['image_url'])
 
     # Add League \
-    league = f"[{club_info['league']}]({config.tm_main + club_info['league_link']})"
-    embed.add_field(name='League', value = league, inline=False)
+    if 'club_page' in pending:
+        embed.add_field(name='League', value = loading, inline=False)
+    else:
+        embed.set_thumbnail(url = club_info['image_url'])
+        league = f"[{club_info['league']}]({config.tm_main + club_info['league_link']})"
+        embed.add_field(name='League', value = league, inline=False)
 
     # Add Table Position
-    embed.add_field(name='Table Position', value = club_info['standing'], inline=False)
+    embed.add_field(name='Table Position', value = club_info.get('standing', loading), inline=False)
 
     # Add Next Match Information
-    embed.add_field(name='Next Matches', value = club_info['next_match_opponent_name'], inline=True)
-    embed.add_field(name='League', value = club_info['next_match_league'], inline=True)
-    embed.add_field(name='Match Time', value = club_info['next_match_timestamp'], inline=True)
+    if 'next_matches' in pending:
+        embed.add_field(name='Next Matches', value = loading, inline=False)
+    else:
+        embed.add_field(name='Next Matches', value = club_info['next_match_opponent_name'], inline=True)
+        embed.add_field(name='League', value = club_info['next_match_league'], inline=True)
+        embed.add_field(name='Match Time', value = club_info['next_match_timestamp'], inline=True)
 
     # Add Domestic Form
-    embed.add_field(name='Domestic League Form', value = club_info['past_results'], inline=False)
+    embed.add_field(name='Domestic League Form', value = club_info.get('past_results', loading), inline=False)
 
     # Add Transfermarkt Link
     embed.add_field(name='TransferMarkt Profile', value=f"[Link]({club_info['link']})", inline=False)
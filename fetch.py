@@ -0,0 +1,191 @@
+import asyncio
+import time
+
+import aiohttp
+
+try:
+    from aiohttp.compression_utils import HAS_BROTLI
+except ImportError:
+    HAS_BROTLI = False
+
+# Local imports
+import config
+import metrics
+import resilience
+import scheduler
+
+# Compressed responses are decoded by aiohttp (brotli needs the optional Brotli package)
+accept_encoding = 'gzip, deflate, br' if HAS_BROTLI else 'gzip, deflate'
+
+# Shared HTTP session. Created lazily so that it binds to the running discord.py event loop.
+_session = None
+
+# Below is a function that returns the pooled, keep-alive session shared by every scrape function.
+async def get_session():
+    """
+    Returns: _session (aiohttp.ClientSession) --> Shared client session with connection pooling
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=config.http_pool_size,
+                                         limit_per_host=config.http_pool_size,
+                                         keepalive_timeout=config.http_keepalive)
+        _session = aiohttp.ClientSession(headers={**config.headers, 'Accept-Encoding': accept_encoding},
+                                         connector=connector)
+    return _session
+
+# Response statuses that are retried with backoff
+retry_statuses = {429, 500, 502, 503, 504}
+
+# Below is a function that sends a GET request through the scheduler, retrying throttled responses.
+async def request(url, read, timeout=None, priority=None, monitor=None, sent=None, headers=None):
+    """
+    Arguments:
+        - url (str) --> URL to download
+        - read (function) --> Coroutine function reading the body from the response
+        - timeout (float) --> Optional total timeout in seconds, per attempt
+        - priority (int) --> scheduler.INTERACTIVE or scheduler.BACKGROUND (defaults to the current task's)
+        - monitor (EndpointMonitor) --> Optional monitor recording the latency of the successful attempt
+        - sent (asyncio.Event) --> Optional event set once the scheduler has released the request
+        - headers (dict) --> Optional extra request headers, ex. If-None-Match
+    Returns: body --> Result of read(response)
+    """
+    if priority is None:
+        priority = scheduler.current_priority.get()
+    session = await get_session()
+    for attempt in range(config.http_max_retries + 1):
+        await scheduler.outbound.acquire(url, priority)
+        if sent is not None:
+            sent.set()
+        start = time.monotonic()
+        try:
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status in retry_statuses and attempt < config.http_max_retries:
+                    scheduler.outbound.backoff(url, attempt, response.headers.get('Retry-After'))
+                    continue
+                response.raise_for_status()
+                body = await read(response)
+
+            # Queue wait is excluded, so the latency only reflects transfermarkt's response time
+            if monitor is not None:
+                monitor.success(time.monotonic() - start)
+            return body
+        except aiohttp.ClientConnectionError:
+            if attempt == config.http_max_retries:
+                raise
+            scheduler.outbound.backoff(url, attempt)
+
+# Errors after which scrape functions fall back to cached or partial data
+fetch_errors = (resilience.CircuitOpenError, asyncio.TimeoutError, aiohttp.ClientError)
+
+# Below is a function that tells whether an error means the endpoint is failing, rather than a bad request.
+def endpoint_failing(error):
+    """
+    Arguments: error (Exception) --> One of fetch_errors
+    Returns: failing (bool) --> True for timeouts, connection errors and 5xx/429 responses, False for
+    other 4xx responses (ex. a 404 for an unknown ID), which must not open the circuit for every caller
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return True
+
+# Below is a function that fetches an endpoint with its adaptive timeout, hedging and circuit breaker.
+async def monitored(url, read, endpoint, priority, headers=None):
+    """
+    Arguments:
+        - url (str) --> URL to download
+        - read (function) --> Coroutine function reading the body from the response
+        - endpoint (str) --> Name of the endpoint, ex. 'profile' or 'rumors'
+        - priority (int) --> scheduler.INTERACTIVE or scheduler.BACKGROUND
+        - headers (dict) --> Optional extra request headers
+    Returns: body --> Result of read(response)
+    """
+    monitor = resilience.monitor(endpoint)
+    probe = monitor.check()
+    if priority is None:
+        priority = scheduler.current_priority.get()
+
+    async def attempt(sent=None):
+        return await request(url, read, monitor.timeout(), priority, monitor, sent, headers)
+
+    start = time.perf_counter()
+    try:
+        # Background requests (refreshes, prefetches, ingestion) are never worth a second request
+        if config.hedge_requests and endpoint in config.hedge_endpoints and priority == scheduler.INTERACTIVE:
+            return await resilience.hedged(monitor, attempt)
+        return await attempt()
+    except fetch_errors as error:
+        if endpoint_failing(error):
+            monitor.failure()
+        raise
+    finally:
+        if probe:
+            monitor.end_probe()
+        # Includes scheduler queue wait and retries, unlike the monitor's latency samples
+        metrics.observe('fetch_' + endpoint, time.perf_counter() - start)
+
+# Below is a function to download a page in chunks, stopping as soon as a streaming parser has what it needs.
+async def fetch_streamed(url, endpoint, make_parser, priority=None):
+    """
+    Arguments:
+        - url (str) --> Page to download
+        - endpoint (str) --> Name of the endpoint, used for timeouts and circuit breaking
+        - make_parser (function) --> Returns a fresh parser with feed(chunk) -> done and result()
+        - priority (int) --> scheduler.INTERACTIVE or scheduler.BACKGROUND (defaults to the current task's)
+    Returns: result --> parser.result()
+    """
+    async def read(response):
+        # A new parser per attempt, so a retried download starts from a clean state
+        parser = make_parser()
+        async for chunk in response.content.iter_chunked(config.stream_chunk_size):
+            if parser.feed(chunk):
+                # The rest of the body is never read; aiohttp closes the connection instead of reusing it
+                break
+        metrics.observe_bytes(endpoint, parser.bytes_read)
+        return parser.result()
+
+    return await monitored(url, read, endpoint, priority)
+
+# Conditional requests sent and answered with 304 Not Modified, per endpoint
+revalidations = {}
+
+# Below is a function to download a page or ceapi endpoint, unless it did not change since an earlier download.
+async def fetch_conditional(url, endpoint, validators=None, priority=None):
+    """
+    Arguments:
+        - url (str) --> Page or ceapi endpoint to download
+        - endpoint (str) --> Name of the endpoint, used for timeouts and circuit breaking
+        - validators (dict) --> 'etag' and 'last_modified' of the copy already held, or None
+        - priority (int) --> scheduler.INTERACTIVE or scheduler.BACKGROUND (defaults to the current task's)
+    Returns:
+        - body (bytes) --> Raw response body, or None if transfermarkt answered 304 Not Modified
+        - validators (dict) --> 'etag' and 'last_modified' of the body (the ones sent, on a 304)
+    """
+    headers = {}
+    if validators is not None:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    async def read(response):
+        if response.status == 304:
+            return None, validators
+        return await response.read(), {'etag': response.headers.get('ETag'),
+                                       'last_modified': response.headers.get('Last-Modified')}
+
+    body, validators = await monitored(url, read, endpoint, priority, headers or None)
+    if headers:
+        counter = revalidations.setdefault(endpoint, {'sent': 0, 'not_modified': 0})
+        counter['sent'] += 1
+        counter['not_modified'] += body is None
+    if body is not None:
+        metrics.observe_bytes(endpoint, len(body))
+    return body, validators
+
+# Below is a function to release pooled connections when the bot shuts down.
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
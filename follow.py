@@ -0,0 +1,176 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+# Local imports
+import cache
+import config
+import scrape
+from records import ClubResult
+
+# Below is a class storing which channels follow which clubs, and the last seen state of each club.
+class Follows:
+    """
+    Each followed club is polled once per interval no matter how many channels follow it. Its
+    last snapshot (league form and next fixtures) and next poll time are stored with it, so a
+    restarted bot neither announces old changes again nor misses the ones made while it was down.
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=config.cache_busy_timeout)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS clubs ('
+                        'club_id TEXT PRIMARY KEY, name TEXT, link TEXT, snapshot TEXT, next_poll REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS followers ('
+                        'club_id TEXT, channel_id INTEGER, PRIMARY KEY (club_id, channel_id))')
+        self.db.commit()
+
+    def follow(self, club, channel_id):
+        """
+        Arguments:
+            - club (ClubResult) --> Club to follow
+            - channel_id (int) --> Discord channel receiving the club's changes
+        Returns: added (bool) --> False if the channel already followed the club
+        """
+        club_id = club.link.split('/')[-1]
+        # A newly followed club is polled on the next tick, to record its current state
+        self.db.execute('INSERT OR IGNORE INTO clubs VALUES (?, ?, ?, NULL, 0)', (club_id, club.name, club.link))
+        added = self.db.execute('INSERT OR IGNORE INTO followers VALUES (?, ?)', (club_id, channel_id)).rowcount
+        self.db.commit()
+        return bool(added)
+
+    def unfollow(self, channel_id, query=''):
+        """
+        Arguments:
+            - channel_id (int) --> Discord channel
+            - query (str) --> Part of the club's name, or '' for every club the channel follows
+        Returns: names (list[str]) --> Names of the clubs no longer followed by the channel
+        """
+        query = cache.normalize(query)
+        followed = self.db.execute('SELECT clubs.club_id, name FROM followers JOIN clubs USING (club_id) '
+                                   'WHERE channel_id = ?', (channel_id,)).fetchall()
+        removed = [(club_id, name) for club_id, name in followed if query in cache.normalize(name)]
+        for club_id, _ in removed:
+            self.db.execute('DELETE FROM followers WHERE club_id = ? AND channel_id = ?', (club_id, channel_id))
+
+        # Clubs without followers are no longer polled
+        self.db.execute('DELETE FROM clubs WHERE club_id NOT IN (SELECT club_id FROM followers)')
+        self.db.commit()
+        return [name for _, name in removed]
+
+    def due(self, until):
+        """
+        Arguments: until (float) --> Clubs due to be polled before this time are returned
+        Returns: clubs (list[tuple]) --> (club_id, name, link, snapshot) of each club due
+        """
+        rows = self.db.execute('SELECT club_id, name, link, snapshot FROM clubs WHERE next_poll <= ?', (until,))
+        return [(club_id, name, link, json.loads(snapshot) if snapshot else None) for club_id, name, link, snapshot in rows]
+
+    def followers(self, club_id):
+        return [row[0] for row in self.db.execute('SELECT channel_id FROM followers WHERE club_id = ?', (club_id,))]
+
+    def polled(self, club_id, snapshot, next_poll):
+        self.db.execute('UPDATE clubs SET snapshot = ?, next_poll = ? WHERE club_id = ?',
+                        (json.dumps(snapshot), next_poll, club_id))
+        self.db.commit()
+
+    def retry(self, club_id, next_poll):
+        self.db.execute('UPDATE clubs SET next_poll = ? WHERE club_id = ?', (next_poll, club_id))
+        self.db.commit()
+
+    def stats(self):
+        return {'clubs': self.db.execute('SELECT COUNT(*) FROM clubs').fetchone()[0],
+                'followers': self.db.execute('SELECT COUNT(*) FROM followers').fetchone()[0]}
+
+# Below is a function returning the parts of a club's information that followers are told about.
+def take_snapshot(club_info, next_matches_json):
+    """
+    Arguments:
+        - club_info (dict) --> Result of scrape.process_df_clubs
+        - next_matches_json (dict) --> json file with 'teams' and 'matches'
+    Returns: snapshot (dict) --> League form, and (kickoff time, opponent, competition) of the next fixtures
+    """
+    fixtures = []
+    for match in next_matches_json['matches'][0:5]:
+        home, away = str(match['match']['home']), str(match['match']['away'])
+        opponent = home if away == club_info['id'] else away
+        fixtures.append([match['match']['time'], next_matches_json['teams'][opponent]['name'],
+                         match['competition']['label']])
+    return {'past_results': club_info['past_results'], 'fixtures': fixtures}
+
+# Below is a function used to compare two snapshots of a club.
+def diff(old, new):
+    """
+    Arguments: old, new (dict) --> Snapshots returned by take_snapshot
+    Returns: changes (dict) --> 'past_results' and/or 'fixtures' as (old, new), empty if nothing changed
+    """
+    changes = {}
+    if old['past_results'] != new['past_results']:
+        changes['past_results'] = (old['past_results'], new['past_results'])
+
+    # Fixtures dropping off the front of the list once played, or new ones appearing at its end,
+    # are not changes by themselves (kickoff times, opponents and postponements are)
+    now = time.time()
+    upcoming = [fixture for fixture in old['fixtures'] if fixture[0] > now]
+    if upcoming != new['fixtures'][:len(upcoming)]:
+        changes['fixtures'] = (old['fixtures'], new['fixtures'])
+    return changes
+
+# Below is a function that decides when a club is polled next, aligned with its kickoff times.
+def next_poll(snapshot, now):
+    """
+    Arguments:
+        - snapshot (dict) --> Snapshot returned by take_snapshot
+        - now (float) --> Time of the poll
+    Returns: next_poll (float) --> Shortly after the next match should be over, or after follow_interval
+    """
+    results_due = [kickoff + config.follow_result_delay for kickoff, _, _ in snapshot['fixtures']
+                   if kickoff + config.follow_result_delay > now]
+    return min([now + config.follow_interval] + results_due)
+
+# Below is a function that re-reads one followed club, bypassing its cached form and fixtures.
+async def poll_club(club_id, name, link):
+    """
+    Returns: snapshot (dict) --> Current snapshot of the club, or None if it could not be read
+    """
+    for kind in ('club_form', 'next_matches'):
+        cache.store.expire(kind, club_id)
+    club_info = await cache.background(scrape.process_df_clubs, ClubResult(name=name, link=link))
+
+    # While transfermarkt is failing, the scrape functions serve the expired form and fixtures:
+    # the poll is retried rather than taken as a fresh snapshot
+    for kind in ('club_form', 'next_matches'):
+        remaining = cache.store.expires_in(kind, club_id)
+        if remaining is None or remaining <= 0:
+            return None
+
+    # Without any fixtures, every followed fixture would look cancelled
+    next_matches_json = cache.store.get_stale('next_matches', club_id)
+    if club_info is None or next_matches_json is None:
+        return None
+    return take_snapshot(club_info, next_matches_json)
+
+# Below is a function that polls every followed club that is due, and reports what changed.
+async def poll_due(notify):
+    """
+    Arguments: notify (function) --> Coroutine function called as notify(channel_ids, club_name, changes)
+    Returns: polled (int) --> Number of clubs polled
+    """
+    # Clubs due within the batch window are polled together (ex. every club playing on the same
+    # matchday), instead of one poll per club every few minutes
+    now = time.time()
+    due = follows.due(now + config.follow_batch_window)
+    snapshots = await asyncio.gather(*[poll_club(club_id, name, link) for club_id, name, link, _ in due])
+
+    for (club_id, name, _, old), new in zip(due, snapshots):
+        if new is None:
+            follows.retry(club_id, now + config.follow_retry)
+            continue
+        follows.polled(club_id, new, next_poll(new, now))
+        changes = diff(old, new) if old is not None else {}
+        if changes:
+            await notify(follows.followers(club_id), name, changes)
+    return len(due)
+
+# Shared subscriptions, polled by the bot's follow loop
+follows = Follows(config.follow_path)
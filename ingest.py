@@ -0,0 +1,82 @@
+import asyncio
+
+# Local imports
+import cache
+import config
+import fetch
+import metrics
+import parse
+import scheduler
+import scrape
+
+stats = metrics.lazy_import('stats')
+
+# Below is a function that ingests the squads and season stats of one league into the stats store.
+async def ingest_league(league_link, slots):
+    """
+    Arguments:
+        - league_link (str) --> League's TransferMarkt startseite path, ex. '/premier-league/startseite/wettbewerb/GB1'
+        - slots (asyncio.Semaphore) --> Bounds the number of requests made at once
+    Returns: updated (int) --> Number of players whose stored stats changed
+    """
+    code = league_link.split('/')[-1]
+    async with slots:
+        league = await scrape.fetch_parsed(config.tm_main + league_link.replace('startseite', 'tabelle'),
+                                           'league', parse.parse_league_table)
+    stats.store.set_league(code, league['name'], league_link)
+
+    # Only clubs that played since their last ingestion can have players whose stats changed
+    clubs = [club for club in league['clubs'] if stats.store.club_changed(club['id'], club['games'])]
+    updated = await asyncio.gather(*[ingest_club(club, code, slots) for club in clubs])
+    return sum(updated)
+
+# Below is a function that ingests one club's squad, recording the club only if every player was read.
+async def ingest_club(club, code, slots):
+    """
+    Arguments:
+        - club (dict) --> Row of parse.parse_league_table
+        - code (str) --> League code, ex. 'GB1'
+        - slots (asyncio.Semaphore) --> Bounds the number of requests made at once
+    Returns: updated (int) --> Number of players whose stored stats changed
+    """
+    try:
+        async with slots:
+            squad = await scrape.fetch_parsed(club['link'].replace('startseite', 'kader'), 'squad', parse.parse_squad)
+    except fetch.fetch_errors:
+        return 0
+
+    async def ingest_player(player):
+        async with slots:
+            # Reuses a fresh cached performance, and leaves a freshly fetched one in the cache
+            player_stats_json = await scrape.get_player_performance(player['id'])
+        if player_stats_json is None:
+            return None
+        return stats.store.update_player(player['id'], player['name'], player['position'], club['id'], player_stats_json)
+
+    results = await asyncio.gather(*[ingest_player(player) for player in squad])
+
+    # A club with a failed player keeps its old games count, so the next pass retries it
+    if None not in results:
+        stats.store.set_club(club['id'], club['name'], code, club['games'], [player['id'] for player in squad])
+    return sum(result is True for result in results)
+
+# Below is a function that ingests every configured league, in the background.
+async def ingest_all():
+    """
+    Returns: updated (int) --> Number of players whose stored stats changed
+    """
+    # Ingestion waits behind every command's requests, and does not count as cache lookups
+    cache.refreshing.set(True)
+    scheduler.current_priority.set(scheduler.BACKGROUND)
+    slots = asyncio.Semaphore(config.ingest_concurrency)
+
+    updated = 0
+    for league_link in config.ingest_leagues:
+        try:
+            updated += await ingest_league(league_link, slots)
+        except fetch.fetch_errors:
+            continue
+        finally:
+            # Written after each league, so an interrupted pass keeps what it read
+            stats.store.save()
+    return updated
@@ -0,0 +1,222 @@
+import cProfile
+import contextvars
+import functools
+import importlib
+import inspect
+import os
+import random
+import time
+from collections import deque
+
+from aiohttp import web
+
+# Local imports
+import config
+
+# Command currently being handled (ex. 'player'), inherited by every task it starts
+command = contextvars.ContextVar('command', default='none')
+
+# Below is a latency histogram for one (command, stage) pair, with cumulative Prometheus-style buckets.
+class Histogram:
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+        self.sum = 0
+        self.recent = deque(maxlen=500)
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def percentile(self, p):
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0
+
+# Histograms keyed by (command, stage)
+histograms = {}
+
+# Extra stats exported next to the histograms, as {name: function returning a (nested) dict}
+collectors = {}
+
+def observe(stage, seconds):
+    key = (command.get(), stage)
+    if key not in histograms:
+        histograms[key] = Histogram()
+    histograms[key].observe(seconds)
+
+# Below is a function recording a startup stage (ex. an import) apart from every command's stages.
+def observe_startup(stage, seconds):
+    token = command.set('startup')
+    try:
+        observe(stage, seconds)
+    finally:
+        command.reset(token)
+
+# Below is a module that is only imported on first use, recording its import time as 'import_<name>'.
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            start = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            observe_startup(f'import_{self._name}', time.perf_counter() - start)
+        return getattr(self._module, attribute)
+
+def lazy_import(name):
+    """
+    Arguments: name (str) --> Module to import, ex. 'numpy'
+    Returns: module (LazyModule) --> Stand-in importing the module when one of its attributes is first used
+    """
+    return LazyModule(name)
+
+# Response bytes read per endpoint
+bytes_read = {}
+
+def observe_bytes(endpoint, size):
+    bytes_read[endpoint] = bytes_read.get(endpoint, 0) + size
+
+# Below is a decorator recording the duration of a scrape, parse or embed function under a stage name.
+def timed(stage):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# Slowest profiled commands, as (seconds, command, path) sorted slowest first
+slowest_profiles = []
+_profiling = False
+
+# Below is a class holding the state of one command being handled.
+class CommandScope:
+    __slots__ = ('name', 'token', 'start', 'profiler')
+
+# Below is a function that labels everything the current task does with a command, and starts timing it.
+def start_command(name):
+    """
+    Arguments: name (str) --> Name of the command being handled, ex. 'player'
+    Returns: scope (CommandScope) --> State to pass to finish_command once the command is done
+    """
+    global _profiling
+    scope = CommandScope()
+    scope.name = name
+    scope.token = command.set(name)
+    scope.profiler = None
+
+    # Opt-in sampling: profile a fraction of commands, one at a time. The profile covers everything
+    # the event loop runs meanwhile, so it is most useful for spotting CPU-heavy stages.
+    if config.profile_sample_rate and not _profiling and random.random() < config.profile_sample_rate:
+        _profiling = True
+        scope.profiler = cProfile.Profile()
+        scope.profiler.enable()
+
+    scope.start = time.perf_counter()
+    return scope
+
+# Below is a function that records a command's total duration (including time waiting for the user).
+def finish_command(scope):
+    global _profiling
+    elapsed = time.perf_counter() - scope.start
+    observe('command', elapsed)
+    command.reset(scope.token)
+    if scope.profiler is not None:
+        scope.profiler.disable()
+        _profiling = False
+        keep_profile(scope.profiler, scope.name, elapsed)
+
+# Below is a decorator applying start_command/finish_command to a handler (ex. an application command).
+def command_timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            scope = start_command(name)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                finish_command(scope)
+        return wrapper
+    return decorator
+
+# Below is a function that dumps a profile if it is among the slowest commands seen so far.
+def keep_profile(profiler, name, elapsed):
+    if len(slowest_profiles) >= config.profile_keep and elapsed <= slowest_profiles[-1][0]:
+        return
+    os.makedirs(config.profile_dir, exist_ok=True)
+    path = os.path.join(config.profile_dir, f'{name}-{int(time.time() * 1000)}-{elapsed * 1000:.0f}ms.prof')
+    profiler.dump_stats(path)
+    slowest_profiles.append((elapsed, name, path))
+    slowest_profiles.sort(reverse=True)
+
+    # Only the slowest profiles are kept on disk
+    while len(slowest_profiles) > config.profile_keep:
+        os.remove(slowest_profiles.pop()[2])
+
+# Below is a function that flattens a nested stats dict into (labels, key, value) samples.
+def _flatten(stats, labels=()):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            for child, child_value in value.items():
+                if isinstance(child_value, dict):
+                    yield from _flatten(child_value, labels + ((key, child),))
+                elif isinstance(child_value, (int, float)):
+                    yield labels + ((key, child),), key, child_value
+        elif isinstance(value, (int, float)):
+            yield labels, key, value
+
+def _labels(pairs):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}' if pairs else ''
+
+# Below is a function rendering every metric in the Prometheus text exposition format.
+def render():
+    lines = ['# TYPE sonny_stage_seconds histogram']
+    for (cmd, stage), histogram in sorted(histograms.items()):
+        labels = (('command', cmd), ('stage', stage))
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'sonny_stage_seconds_bucket{_labels(labels + (("le", bound),))} {count}')
+        lines.append(f'sonny_stage_seconds_bucket{_labels(labels + (("le", "+Inf"),))} {histogram.total}')
+        lines.append(f'sonny_stage_seconds_sum{_labels(labels)} {histogram.sum}')
+        lines.append(f'sonny_stage_seconds_count{_labels(labels)} {histogram.total}')
+
+    lines.append('# TYPE sonny_bytes_read_total counter')
+    for endpoint, size in sorted(bytes_read.items()):
+        lines.append(f'sonny_bytes_read_total{_labels((("endpoint", endpoint),))} {size}')
+
+    for name, collect in collectors.items():
+        for labels, key, value in _flatten(collect()):
+            lines.append(f'sonny_{name}_{key}{_labels(labels)} {float(value)}')
+    return '\n'.join(lines) + '\n'
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type='text/plain')
+
+# Below is a function that starts the local metrics endpoint (ex. http://127.0.0.1:9108/metrics).
+async def start_server(port):
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
@@ -0,0 +1,160 @@
+import math
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Local imports
+import cache
+import config
+
+# Letters that do not decompose into a base letter and an accent
+special_letters = str.maketrans({'ø': 'o', 'æ': 'ae', 'œ': 'oe', 'ß': 'ss', 'ł': 'l', 'đ': 'd', 'ı': 'i', '-': ' '})
+
+# Below is a function that splits a name into trigrams (each word padded like PostgreSQL's pg_trgm).
+def trigrams(text):
+    """
+    Arguments: text (str) --> Player or club name, or a search query
+    Returns: grams (set[str]) --> Lowercase trigrams, with accents removed
+    """
+    text = unicodedata.normalize('NFKD', text.lower().translate(special_letters))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    grams = set()
+    for word in text.split():
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+# Below is a local index of every player and club name seen in quick search results.
+class NameIndex:
+    """
+    Rows are stored exactly as parse_quick_search returns them, keyed by transfermarkt link, so
+    a local answer looks the same as a remote one. A query is scored against each name by the
+    share of its trigrams found in the name (so 'haaland' fully matches 'Erling Haaland'), with
+    ties broken by overall trigram similarity. Rows are only kept while they are as fresh as a
+    cached search (and at most name_index_max of them), so a player's club is never older than it
+    would be from the cache.
+    """
+    def __init__(self, source=None):
+        self.rows = {}
+        # Time each link was last seen, least recently seen first
+        self.seen = OrderedDict()
+        self.grams = {}
+        self.postings = {'players': {}, 'clubs': {}}
+        self.counters = {'local_hits': 0, 'suggestions': 0, 'misses': 0}
+        # Function returning the (results, time retrieved) to index on first use, oldest first
+        self.source = source
+
+    # Below is a function that indexes the rows of the source on first use, so processes that never search skip it.
+    def warm(self):
+        if self.source is not None:
+            source, self.source = self.source, None
+            for results, seen in source():
+                self.add(results, seen)
+
+    def add(self, results, seen=None):
+        """
+        Arguments:
+            - results (dict) --> Quick search results, as returned by parse.parse_quick_search
+            - seen (float) --> Time the results were retrieved (defaults to now)
+        """
+        self.warm()
+        seen = time.time() if seen is None else seen
+        if seen < time.time() - config.cache_ttl['search']:
+            return
+        for kind in ('players', 'clubs'):
+            for row in results[kind]:
+                link = row['link']
+                if self.seen.get(link, 0) > seen:
+                    continue
+                self.seen[link] = seen
+                self.seen.move_to_end(link)
+                if link not in self.rows:
+                    self.grams[link] = trigrams(row['name'])
+                    for gram in self.grams[link]:
+                        self.postings[kind].setdefault(gram, set()).add(link)
+                # Keep the latest club and position of a player
+                self.rows[link] = row
+        self.evict()
+
+    # Below is a function that drops the rows seen before the search TTL, and the least recently seen beyond name_index_max.
+    def evict(self):
+        oldest = time.time() - config.cache_ttl['search']
+        while self.seen and (len(self.seen) > config.name_index_max or next(iter(self.seen.values())) < oldest):
+            link, _ = self.seen.popitem(last=False)
+            del self.rows[link]
+            for gram in self.grams.pop(link):
+                for postings in self.postings.values():
+                    links = postings.get(gram)
+                    if links is not None:
+                        links.discard(link)
+                        if not links:
+                            del postings[gram]
+
+    def scored(self, kind, query, keep, minimum):
+        """
+        Arguments:
+            - kind (str) --> 'players' or 'clubs'
+            - query (str) --> Normalized search query
+            - keep (function) --> Filter applied to rows, ex. leaving out retired players
+            - minimum (float) --> Lowest share of the query's trigrams a name must contain
+        Returns: scored (list) --> (containment, similarity, row) of matching rows, best first
+        """
+        self.warm()
+        grams = trigrams(query)
+        if not grams:
+            return []
+        postings = self.postings[kind]
+
+        # A name containing `needed` of the query's trigrams contains at least one of its
+        # len(grams) - needed + 1 rarest trigrams, so common trigrams (ex. '  m') are never scanned
+        needed = max(1, math.ceil(minimum * len(grams)))
+        rarest = sorted(grams, key=lambda gram: len(postings.get(gram, ())))[:len(grams) - needed + 1]
+        candidates = set()
+        for gram in rarest:
+            candidates.update(postings.get(gram, ()))
+
+        scored = []
+        for link in candidates:
+            shared = len(grams & self.grams[link])
+            if shared >= needed and keep(self.rows[link]):
+                scored.append((shared / len(grams), 2 * shared / (len(grams) + len(self.grams[link])), self.rows[link]))
+        scored.sort(key=lambda entry: (entry[0], entry[1]), reverse=True)
+        return scored
+
+    def lookup(self, kind, query, keep):
+        """
+        Arguments: same as scored
+        Returns: rows (list[dict]) --> The single confident match, or None to ask transfermarkt
+        """
+        # Names within the margin of the threshold are scored too, to check that the best one stands out
+        now = time.time()
+        scored = self.scored(kind, query, lambda row: keep(row) and
+                             now - self.seen[row['link']] < config.cache_ttl['search'],
+                             config.name_index_min_score - config.name_index_margin)
+
+        # Only answer locally when the query is close to one whole name, which clearly stands out
+        # (ex. 'erling haaland', not 'haaland' or 'erling', which transfermarkt may match to several players)
+        if scored and scored[0][0] >= config.name_index_min_score and \
+                scored[0][1] >= config.name_index_min_similarity and \
+                (len(scored) == 1 or scored[0][0] - scored[1][0] >= config.name_index_margin):
+            self.counters['local_hits'] += 1
+            return [scored[0][2]]
+        self.counters['misses'] += 1
+        return None
+
+    def suggest(self, kind, query, keep):
+        """
+        Arguments: same as scored
+        Returns: rows (list[dict]) --> Closest names, for queries transfermarkt found nothing for (ex. typos)
+        """
+        scored = self.scored(kind, query, keep, config.name_index_suggest_score)
+        rows = [row for _, _, row in scored[:config.name_index_suggestions]]
+        if rows:
+            self.counters['suggestions'] += 1
+        return rows
+
+    def stats(self):
+        return {'entries': len(self.rows), **self.counters}
+
+# Shared index used by the scrape module, warmed up on first use with the unexpired searches of the cache
+index = NameIndex(lambda: cache.store.values('search'))
@@ -0,0 +1,308 @@
+import asyncio
+import contextvars
+import functools
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Local imports
+import config
+import metrics
+
+# lxml is imported by the first parse rather than at startup
+etree = metrics.lazy_import('lxml.etree')
+html = metrics.lazy_import('lxml.html')
+
+# Below is a function that builds an XPath predicate matching one class of an element (like BeautifulSoup).
+def has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# Below is a function equivalent to BeautifulSoup's get_text().
+def get_text(element, separator='', strip=False):
+    """
+    Arguments:
+        - element (lxml element) --> Node to extract text from
+        - separator (str) --> String placed between text fragments
+        - strip (bool) --> Strip whitespace and drop empty fragments
+    Returns: text (str) --> Text of the node and its descendants
+    """
+    strings = element.xpath('.//text()')
+    if strip:
+        strings = [string.strip() for string in strings]
+        strings = [string for string in strings if string]
+    return separator.join(strings)
+
+# Below is a function to decode one of transfermarkt's ceapi json responses.
+def parse_json(page):
+    return json.loads(page)
+
+# Below is a function to parse the player, club and coach tables of a quick search page.
+@metrics.timed('parse_search')
+def parse_quick_search(page):
+    """
+    Arguments: page (bytes) --> Raw quick search HTML
+    Returns: results (dict) --> Lists of player, club and coach rows
+    """
+    tree = html.fromstring(page)
+    results = {'players': [], 'clubs': [], 'coaches': []}
+
+    for row in tree.xpath(f"//tr[{has_class('even')} or {has_class('odd')}]"):
+        # Read every link and cell of the row once
+        links = row.xpath('.//a')
+        if len(links) < 2:
+            continue
+        href = links[1].get('href')
+        cells = row.xpath('.//td')
+
+        # Separate players from managers or trainers
+        if 'spieler' in href:
+            results['players'].append({'name': get_text(cells[2]),
+                                       'club': get_text(cells[3]),
+                                       'position': get_text(cells[4]),
+                                       'link': config.tm_main + href})
+        elif 'trainer' in href:
+            results['coaches'].append({'name': get_text(cells[2]),
+                                       'club': get_text(cells[3]),
+                                       'link': config.tm_main + href})
+
+    # Club name and link are in the first link of each 'hauptlink' cell
+    for link in tree.xpath(f"//td[{has_class('hauptlink')}]/descendant::a[1]"):
+        if 'startseite' in link.get('href'):
+            results['clubs'].append({'name': link.get('title'),
+                                     'link': config.tm_main + link.get('href')})
+
+    return results
+
+# Below is a function to parse the header and availability status of a player profile page.
+@metrics.timed('parse_profile')
+def parse_player_profile(page):
+    """
+    Arguments: page (bytes) --> Raw player profile HTML
+    Returns:
+        - header (dict) --> Player image URL, position and club link
+        - status (str) --> Player's availability status
+    """
+    tree = html.fromstring(page)
+    header = {}
+
+    # Retrieve player image URL
+    header['image_url'] = tree.xpath(f"//img[{has_class('data-header__profile-image')}]/@src")[0]
+
+    # Retrieve player position
+    for label in tree.xpath(f"//li[{has_class('data-header__label')}]"):
+        label_text = get_text(label, strip=True)
+        if label_text.startswith('Position:'):
+            header['position'] = label_text.replace('Position:', '')
+
+    # Get player stats (Injury, International Calls)
+    status_box = tree.xpath(f"(//div[{has_class('verletzungsbox')}])[1]/descendant::div[{has_class('text')}][1]")
+    status = get_text(status_box[0], separator=': ', strip=True) if status_box else "Available"
+
+    # Retrieve club page link
+    header['clublink'] = tree.xpath(f"(//span[{has_class('data-header__club')}])[1]/descendant::a[1]/@href")[0]
+
+    return header, status
+
+# Below is an incremental parser extracting the same fields as parse_player_profile from a page fed in chunks.
+class ProfileExtractor:
+    """
+    Every header field sits in the page's data-header, at the top of the page. Like
+    parse_player_profile, the status comes from the first verletzungsbox anywhere in the page:
+    the rest of the page is skipped once the header and an injury box have been read, while an
+    available player (no injury box) is only known once the whole page has been read.
+    """
+    def __init__(self):
+        self.parser = etree.HTMLPullParser(events=('end',))
+        self.header = {}
+        self.status = None
+        self.header_done = False
+        self.club_found = False
+        self.bytes_read = 0
+
+    def feed(self, chunk):
+        """
+        Arguments: chunk (bytes) --> Next part of the raw player profile HTML
+        Returns: done (bool) --> True once every field has been captured
+        """
+        self.bytes_read += len(chunk)
+        self.parser.feed(chunk)
+        self.read_events()
+        return self.header_done and self.status is not None
+
+    def read_events(self):
+        for event, element in self.parser.read_events():
+            classes = element.get('class', '').split()
+            if element.tag == 'img' and 'data-header__profile-image' in classes and 'image_url' not in self.header:
+                self.header['image_url'] = element.get('src')
+            elif element.tag == 'li' and 'data-header__label' in classes:
+                label_text = get_text(element, strip=True)
+                if label_text.startswith('Position:'):
+                    self.header['position'] = label_text.replace('Position:', '')
+            elif element.tag == 'span' and 'data-header__club' in classes and not self.club_found:
+                self.club_found = True
+                self.header['clublink'] = element.xpath('descendant::a[1]/@href')[0]
+            elif element.tag == 'div' and 'verletzungsbox' in classes and self.status is None:
+                status_box = element.xpath(f"descendant::div[{has_class('text')}][1]")
+                self.status = get_text(status_box[0], separator=': ', strip=True) if status_box else "Available"
+            elif element.tag == 'header' and 'data-header' in classes:
+                self.header_done = True
+
+    def result(self):
+        """
+        Returns:
+            - header (dict) --> Player image URL, position and club link
+            - status (str) --> Player's availability status
+        """
+        if self.status is None:
+            # The whole page was read: flush the parser's last elements, in case they hold the injury box
+            self.parser.close()
+            self.read_events()
+        if 'image_url' not in self.header or 'clublink' not in self.header:
+            raise ValueError('Player profile page is missing its header')
+        return self.header, self.status or "Available"
+
+# Below is a function to parse the header and domestic league form of a club spielplan page.
+@metrics.timed('parse_club')
+def parse_club_page(page):
+    """
+    Arguments: page (bytes) --> Raw club spielplan HTML
+    Returns:
+        - header (dict) --> Club image URL, league and league link
+        - form (dict) --> Table standing and past results
+    """
+    tree = html.fromstring(page)
+    header, form = {}, {}
+
+    # Get club image url
+    header['image_url'] = tree.xpath(f"(//div[{has_class('data-header__profile-container')}])[1]/descendant::img[1]/@src")[0]
+
+    # Get club league
+    league = tree.xpath(f"(//span[{has_class('data-header__club')}])[1]")[0]
+    header['league'] = get_text(league, strip=True)
+    header['league_link'] = league.xpath('descendant::a[1]/@href')[0]
+
+    # Get club standing
+    standing = tree.xpath(f"(//span[{has_class('data-header__content')}])[2]/descendant::a[1]")[0]
+    form['standing'] = get_text(standing, strip=True)
+
+    # Scrape past match results from the domestic league box only
+    results = []
+    for box in tree.xpath(f"//div[{has_class('box')}]"):
+        h2_a = box.xpath('descendant::h2[1]/descendant::a[1]/@href')
+        if not h2_a or header['league_link'] not in h2_a[0]:
+            continue
+        rows = box.xpath(f"(descendant::div[{has_class('responsive-table')}])[1]"
+                         "/descendant::table[1]/descendant::tbody[1]//tr")
+        for row in rows:
+            for a_span in row.xpath(f".//td[{has_class('zentriert')}]/descendant::a[1]/descendant::span[1]"):
+                score = get_text(a_span).strip()
+                if score and score[0] != '-':
+                    result = a_span.get('class', '').split()
+                    results.append('D' if not result else 'W' if result[0] == 'greentext' else 'L')
+
+    form['past_results'] = (" ").join(results[-5:])
+    return header, form
+
+# Below is a function to parse the clubs of a league table (tabelle) page.
+@metrics.timed('parse_league')
+def parse_league_table(page):
+    """
+    Arguments: page (bytes) --> Raw league table HTML
+    Returns: league (dict) --> League name, and a row per club with its name, ID, link and games played
+    """
+    tree = html.fromstring(page)
+    headline = tree.xpath(f"//h1[{has_class('data-header__headline-wrapper')}]")
+    league = {'name': get_text(headline[0], strip=True) if headline else '', 'clubs': []}
+
+    # The club name cell is the 'hauptlink' cell with a club link, followed by the games played
+    for cell in tree.xpath(f"//table[{has_class('items')}]/tbody/tr/td[{has_class('hauptlink')}][a[contains(@href, '/verein/')]]"):
+        link = cell.xpath("a[contains(@href, '/verein/')]")[0]
+        href = link.get('href').split('/')
+        club_id = href[href.index('verein') + 1]
+        league['clubs'].append({'name': link.get('title') or get_text(link, strip=True),
+                                'id': club_id,
+                                'link': f'{config.tm_main}/{href[1]}/startseite/verein/{club_id}',
+                                'games': int(get_text(cell.xpath('following-sibling::td[1]')[0], strip=True) or 0)})
+    return league
+
+# Below is a function to parse the players of a club squad (kader) page.
+@metrics.timed('parse_squad')
+def parse_squad(page):
+    """
+    Arguments: page (bytes) --> Raw club squad HTML
+    Returns: squad (list[dict]) --> Name, position, ID and link of every player
+    """
+    tree = html.fromstring(page)
+    squad = []
+    for row in tree.xpath(f"//table[{has_class('items')}]/tbody/tr"):
+        link = row.xpath(f".//td[{has_class('hauptlink')}]/a[contains(@href, '/profil/spieler/')]")
+        if not link:
+            continue
+        position = row.xpath(f".//table[{has_class('inline-table')}]//tr[2]/td")
+        squad.append({'name': get_text(link[0], strip=True),
+                      'position': get_text(position[0], strip=True) if position else '',
+                      'id': link[0].get('href').split('/')[-1],
+                      'link': config.tm_main + link[0].get('href')})
+    return squad
+
+# Parse executor, created on first use (see config.parse_executor)
+_executor = None
+_slots = None
+_counters = {'queued': 0, 'running': 0}
+
+def get_executor():
+    global _executor, _slots
+    if _executor is None:
+        if config.parse_executor == 'process':
+            # Spawned workers do not inherit the event loop or open sockets of the bot
+            _executor = ProcessPoolExecutor(config.parse_workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            _executor = ThreadPoolExecutor(config.parse_workers, thread_name_prefix='parse')
+        _slots = asyncio.Semaphore(config.parse_queue_limit)
+    return _executor
+
+# Below is a function that runs a parse function off the event loop, so parsing never blocks other commands.
+async def offload(func, page):
+    """
+    Arguments:
+        - func (function) --> Parse function of this module, ex. parse_player_profile
+        - page (bytes) --> Raw response body
+    Returns: result --> Plain dicts/strings returned by func (no lxml objects cross the executor boundary)
+    """
+    if not config.parse_executor:
+        return func(page)
+
+    executor = get_executor()
+    start = time.perf_counter()
+
+    # At most parse_queue_limit pages are handed to the executor; later callers wait here
+    _counters['queued'] += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _counters['queued'] -= 1
+
+    _counters['running'] += 1
+    try:
+        if config.parse_executor == 'process':
+            # Stage timings recorded in a worker process are lost, only parse_offload is kept
+            call = functools.partial(func, page)
+        else:
+            call = functools.partial(contextvars.copy_context().run, func, page)
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+    finally:
+        _counters['running'] -= 1
+        _slots.release()
+        metrics.observe('parse_offload', time.perf_counter() - start)
+
+# Below is a function returning the parse executor's queue depth, for the metrics endpoint.
+def stats():
+    return dict(_counters)
+
+# Below is a function to stop the parse workers when the bot shuts down.
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+
+# Below are the lightweight records returned by the search functions in scrape.py.
+@dataclass(slots=True)
+class PlayerResult:
+    name: str
+    club: str
+    position: str
+    link: str
+
+@dataclass(slots=True)
+class ClubResult:
+    name: str
+    link: str
@@ -0,0 +1,37 @@
+import asyncio
+
+# Local imports
+import cache
+import config
+import scheduler
+import scrape
+
+# Cache kinds making up a player's and a club's embed
+player_kinds = ('player_header', 'player_status', 'performance', 'rumors')
+club_kinds = ('club_header', 'club_form', 'next_matches')
+
+# Below is a function used to check whether any cached part of an entry expires soon.
+def expiring(kinds, key):
+    remaining = [cache.store.expires_in(kind, key) for kind in kinds]
+    return any(seconds is not None and seconds < config.refresh_ahead for seconds in remaining)
+
+# Below is a function that re-fetches popular players and clubs before their cached data expires.
+async def refresh_popular():
+    """
+    Returns: refreshed (int) --> Number of players and clubs refreshed in this pass
+    """
+    # Leave the request budget to commands while any are waiting
+    if scheduler.outbound.waiting(scheduler.INTERACTIVE):
+        return 0
+
+    due = []
+    for kind, key, (arg,) in cache.popularity.hot(config.refresh_min_score):
+        if len(due) == config.refresh_budget:
+            break
+        if kind == 'player' and expiring(player_kinds, key):
+            due.append((scrape.get_stats, {'link': arg}))
+        elif kind == 'club' and expiring(club_kinds, key):
+            due.append((scrape.process_df_clubs, arg))
+
+    await asyncio.gather(*[cache.background(func, arg) for func, arg in due])
+    return len(due)
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import deque
+
+# Local imports
+import config
+
+# Below is the error raised when a request is skipped because its endpoint's circuit is open.
+class CircuitOpenError(Exception):
+    pass
+
+# Below is a class tracking latency and failures for one endpoint (ex. 'rumors').
+class EndpointMonitor:
+    """
+    Recent latencies give the endpoint an adaptive timeout and a hedging delay. Consecutive
+    failures open a circuit breaker: requests are refused for a cooldown, after which a
+    single probe is let through (half-open) and closes the circuit again if it succeeds.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.latencies = deque(maxlen=config.latency_window)
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.hedges = 0
+
+    def percentile(self, p):
+        """
+        Arguments: p (float) --> Percentile between 0 and 100
+        Returns: latency (float) --> Observed latency in seconds, or None without enough samples
+        """
+        if len(self.latencies) < config.latency_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def timeout(self):
+        """
+        Returns: timeout (float) --> Adaptive timeout in seconds, derived from the observed p99
+        """
+        p99 = self.percentile(99)
+        if p99 is None:
+            return config.timeout_default.get(self.name, config.timeout_max)
+        return min(config.timeout_max, max(config.timeout_min, p99 * config.timeout_multiplier))
+
+    def check(self):
+        """
+        Raise CircuitOpenError if the endpoint is cooling down after repeated failures.
+        Returns: probe (bool) --> True if this request is the half-open probe (see end_probe)
+        """
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at < config.breaker_cooldown or self.probing:
+            raise CircuitOpenError(self.name)
+        self.probing = True
+        return True
+
+    def end_probe(self):
+        # A probe that ended without a result (ex. cancelled) lets the next request probe instead.
+        self.probing = False
+
+    def success(self, latency):
+        self.latencies.append(latency)
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= config.breaker_threshold:
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {'p50': self.percentile(50), 'p95': self.percentile(95), 'timeout': self.timeout(),
+                'hedges': self.hedges, 'failures': self.failures, 'open': self.opened_at is not None}
+
+# Monitors for every endpoint the scrape module calls
+monitors = {}
+
+def monitor(name):
+    if name not in monitors:
+        monitors[name] = EndpointMonitor(name)
+    return monitors[name]
+
+# Below is a function that runs an attempt, and a second (hedged) attempt if the first is slower than p95.
+async def hedged(endpoint, attempt):
+    """
+    Arguments:
+        - endpoint (EndpointMonitor) --> Monitor of the endpoint being requested
+        - attempt (function) --> Coroutine function performing one request, setting the given event once sent
+    Returns: result --> Result of whichever attempt succeeded first
+    """
+    sent = asyncio.Event()
+    first = asyncio.ensure_future(attempt(sent))
+    delay = endpoint.percentile(config.hedge_percentile)
+    if delay is None:
+        return await first
+
+    pending = {first}
+    try:
+        # The hedging delay starts once the first attempt has left the scheduler queue
+        waiter = asyncio.ensure_future(sent.wait())
+        await asyncio.wait({first, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            endpoint.hedges += 1
+            pending.add(asyncio.ensure_future(attempt()))
+
+        # Return the first successful attempt; only raise if every attempt failed
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
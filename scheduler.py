@@ -0,0 +1,207 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Local imports
+import config
+
+# Request priorities. Lower values are dispatched first.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Priority of requests sent by the current task (background refreshes set BACKGROUND)
+current_priority = contextvars.ContextVar('current_priority', default=INTERACTIVE)
+
+# Below is a group of speculative requests (ex. one prefetched search result), raised to INTERACTIVE once a user waits on it.
+class RequestGroup:
+    def __init__(self):
+        self.promoted = False
+
+# Request group of the current task, if any
+current_group = contextvars.ContextVar('current_group', default=None)
+
+# Below is a token bucket limiting the request rate for a host or endpoint class.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Below is a function returning how long until a token is available (0 if one is available now).
+    def delay(self, now):
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+# Below is a function that classifies a URL into the endpoint class used for rate limiting.
+def endpoint_class(url):
+    """
+    Arguments: url (str) --> URL about to be fetched
+    Returns: (host, endpoint_class) --> ex. ('www.transfermarkt.us', 'ceapi')
+    """
+    parts = urlsplit(url)
+    return parts.netloc, 'ceapi' if parts.path.startswith('/ceapi/') else 'html'
+
+# Below is the central scheduler every outbound request waits on before it is sent.
+class RequestScheduler:
+    """
+    Requests are queued by (priority, arrival order) and released once both the host bucket
+    and the endpoint class bucket have a token, and the host is not backing off after a 429/503.
+    """
+    def __init__(self, host_limit, class_limits):
+        self.host_limit = host_limit
+        self.class_limits = class_limits
+        self.buckets = {}
+        self.blocked_until = {}
+        self.queue = []
+        self.order = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+
+        # Metrics
+        self.waits = deque(maxlen=1000)
+        self.counters = {'requests': 0, 'retries': 0, 'throttled': 0}
+
+    def _bucket(self, key, limit):
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(*limit)
+        return self.buckets[key]
+
+    async def acquire(self, url, priority=INTERACTIVE):
+        """
+        Arguments:
+            - url (str) --> URL about to be fetched
+            - priority (int) --> INTERACTIVE for commands, BACKGROUND for refreshes
+        """
+        host, kind = endpoint_class(url)
+        group = current_group.get()
+        if group is not None and group.promoted:
+            priority = INTERACTIVE
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (priority, next(self.order), host, kind, time.monotonic(), future, group))
+
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self._dispatch())
+        self.wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        while self.queue:
+            self.wakeup.clear()
+            now = time.monotonic()
+            next_delay = None
+
+            # Background requests never take tokens from a host that interactive requests are waiting on
+            interactive_hosts = {entry[2] for entry in self.queue if entry[0] == INTERACTIVE}
+
+            # Release the first queued request (in priority order) whose buckets have tokens
+            for entry in sorted(self.queue):
+                priority, _, host, kind, enqueued, future, _ = entry
+                if future.done():
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                    break
+                if priority != INTERACTIVE and host in interactive_hosts:
+                    continue
+
+                host_bucket = self._bucket(host, self.host_limit)
+                class_bucket = self._bucket((host, kind), self.class_limits[kind])
+                delay = max(host_bucket.delay(now), class_bucket.delay(now),
+                            self.blocked_until.get(host, 0) - now)
+                if delay <= 0:
+                    host_bucket.consume()
+                    class_bucket.consume()
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                    self.waits.append(now - enqueued)
+                    self.counters['requests'] += 1
+                    future.set_result(None)
+                    break
+                next_delay = delay if next_delay is None else min(next_delay, delay)
+            else:
+                # Nothing can be sent yet: sleep until a token frees up or a new request arrives
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), next_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def backoff(self, url, attempt, retry_after=None):
+        """
+        Arguments:
+            - url (str) --> URL that was throttled or failed
+            - attempt (int) --> Number of the failed attempt, starting at 0
+            - retry_after (str) --> Value of the response's Retry-After header, if any
+        Returns: delay (float) --> Seconds the host is paused before the retry is released
+        """
+        host, _ = endpoint_class(url)
+        delay = random.uniform(0, min(config.http_backoff_cap, config.http_backoff_base * 2 ** attempt))
+        delay = max(delay, parse_retry_after(retry_after))
+
+        # Every request to the host waits, not just the one that was throttled
+        self.blocked_until[host] = max(self.blocked_until.get(host, 0), time.monotonic() + delay)
+        self.counters['retries'] += 1
+        if retry_after is not None:
+            self.counters['throttled'] += 1
+        return delay
+
+    def promote(self, group):
+        """
+        Arguments: group (RequestGroup) --> Group whose queued and future requests become INTERACTIVE
+        """
+        group.promoted = True
+        self.queue = [(INTERACTIVE, *entry[1:]) if entry[6] is group else entry for entry in self.queue]
+        heapq.heapify(self.queue)
+        self.wakeup.set()
+
+    def waiting(self, priority):
+        # Number of queued requests with the given priority
+        return sum(1 for entry in self.queue if entry[0] == priority)
+
+    def stats(self):
+        """
+        Returns: stats (dict) --> Queue depth per priority, request counters and queue wait times (ms)
+        """
+        depth = {}
+        for priority, *_ in self.queue:
+            depth[priority] = depth.get(priority, 0) + 1
+        waits = sorted(self.waits)
+        return {'queue_depth': len(self.queue),
+                'queue_depth_by_priority': depth,
+                'wait_ms_p50': waits[len(waits) // 2] * 1000 if waits else 0,
+                'wait_ms_max': waits[-1] * 1000 if waits else 0,
+                **self.counters}
+
+# Below is a function that converts a Retry-After header (seconds or HTTP date) into seconds.
+def parse_retry_after(value):
+    if not value:
+        return 0
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0
+
+# Below is a function returning one bot process's share of a rate limit, when running as several processes.
+def process_share(limit):
+    rate, burst = limit
+    return rate / config.rate_processes, max(1, burst / config.rate_processes)
+
+# Shared scheduler used by the fetch module
+outbound = RequestScheduler(process_share(config.rate_limit_host),
+                            {kind: process_share(limit) for kind, limit in config.rate_limit_class.items()})
@@ -1,244 +1,550 @@
+import asyncio
+import hashlib
 from datetime import datetime
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
 
 # Local imports
+import cache
 import config
+import fetch
+import metrics
+import names
+import parse
+import scheduler
+from records import ClubResult, PlayerResult
+
+# Parse results reused (page unchanged) and computed, for the metrics endpoint
+parse_memo = {'reused': 0, 'parsed': 0}
+
+# Below is a function that downloads and parses a page, reusing the earlier result when it did not change.
+async def fetch_parsed(url, endpoint, parse_func):
+    """
+    Arguments:
+        - url (str) --> Page or ceapi endpoint to download
+        - endpoint (str) --> Name of the endpoint, used for timeouts and circuit breaking
+        - parse_func (function) --> Parse function of the parse module, ex. parse.parse_club_page
+    Returns: result --> Result of parse_func (tuples come back as lists when reused)
+    """
+    # Validators are only sent while the result of the page they describe is still stored
+    validators = cache.store.get_stale('validators', url)
+    if validators is not None and cache.store.get_stale('parsed', parse_func.__name__ + validators['digest']) is None:
+        validators = None
+
+    body, received = await fetch.fetch_conditional(url, endpoint, validators)
+    if body is None:
+        result = cache.store.get_stale('parsed', parse_func.__name__ + validators['digest'])
+        if result is not None:
+            parse_memo['reused'] += 1
+            return result
+        body, received = await fetch.fetch_conditional(url, endpoint)
+
+    # Parsed results are memoized by a hash of the page, so an unchanged page is never parsed twice
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    result = cache.store.get_stale('parsed', parse_func.__name__ + digest)
+    if result is None:
+        result = await parse.offload(parse_func, body)
+        cache.store.set('parsed', parse_func.__name__ + digest, result)
+        parse_memo['parsed'] += 1
+    else:
+        parse_memo['reused'] += 1
+
+    if received['etag'] or received['last_modified']:
+        cache.store.set('validators', url, {**received, 'digest': digest})
+    return result
 
 # Below function converts command argument into searchable transfermarkt query.
-def search_player(command_args):
+@metrics.timed('search_player')
+async def search_player(command_args):
     """
     Arguments: command_args (str): Name of player that the user wishes to search
-    Returns: results_df (df): pandas df of resulting player name, age, club, position, and link
-    """
-    # Process command_args string
-    name_query = config.tm_search + '+'.join(command_args.split())
-
-    # Initialize empty lists for names, clubs, positions, ages, and Transfermarkt links
-    p_names, p_clubs, p_positions, p_links = [], [], [], []
-
-    # Parse through HTML data
-    page = requests.get(name_query, headers=config.headers)
-    soup = BeautifulSoup(page.content, 'lxml')
-
-    for result in soup.find_all('tr', {'class':['even', 'odd']}):
-        # Remove managers or trainers from search
-        if 'spieler' in result.find_all('a')[1].get('href'):
-            # Check if player is retired. If so, not included in list.
-            if result.find_all('td')[3].get_text() in ["Retired", "---"]:
-                continue
-            p_names.append(result.find_all('td')[2].get_text())
-            p_clubs.append(result.find_all('td')[3].get_text())
-            p_positions.append(result.find_all('td')[4].get_text())
-            p_links.append(config.tm_main + result.find_all('a')[1].get('href'))
-
-    # Complete dataframe
-    cols = {'Name': p_names,
-            'Club': p_clubs,
-            'Position': p_positions,
-            'Link': p_links}
-    results_df = pd.DataFrame(cols)
-    return results_df
+    Returns: players (list[PlayerResult]): Resulting player names, clubs, positions, and links
+    """
+    query = cache.normalize(command_args)
+
+    # A cached search is answered exactly as transfermarkt did, otherwise well-known names are resolved
+    # locally, and the rest retrieve the shared quick search result
+    players = names.index.lookup('players', query, is_active_player) if not cache.store.fresh('search', query) else None
+    if players is None:
+        players = [player for player in (await quick_search(query))['players'] if is_active_player(player)]
+
+        # Suggest close names when transfermarkt finds nothing (ex. a typo)
+        if not players:
+            players = names.index.suggest('players', query, is_active_player)
+
+    return [PlayerResult(**player) for player in players]
+
+# Below is a function used to check whether a player is still active.
+def is_active_player(player):
+    # Check if player is retired. If so, not included in list.
+    return player['club'] not in ["Retired", "---"]
+
+# Below is a function used to scrape a transfermarkt quick search once for every search command.
+@metrics.timed('quick_search')
+@cache.coalesce('search')
+async def quick_search(query):
+    """
+    Arguments: query (str) --> Normalized player or club name
+    Returns: results (dict) --> Player, club and coach rows found on the quick search page
+    """
+    # Check the cache for a previous search of the same name
+    results = cache.store.get('search', query)
+    if results is not None:
+        return results
+
+    # Serve a recently expired search instantly, and revalidate it in the background
+    results = cache.store.get_recent('search', query)
+    if results is not None:
+        cache.revalidate(quick_search, query)
+        return results
+
+    # Process query string
+    name_query = config.tm_search + '+'.join(query.split())
+
+    # Parse the player, club and coach tables in one pass
+    try:
+        results = await fetch_parsed(name_query, 'search', parse.parse_quick_search)
+    except fetch.fetch_errors:
+        # Serve an expired search if transfermarkt is failing
+        results = cache.store.get_stale('search', query)
+        if results is None:
+            raise
+        return results
+    names.index.add(results)
+
+    cache.store.set('search', query, results)
+    return results
 
 # Below is a function used to scrape and parse player information
-def process_df(df):
+async def process_df(player):
     """
     Arguments:
-        - df (pandas df) --> Pandas df (single row) with columns Name, Club, Position, Link
+        - player (PlayerResult) --> Selected search result with name, club, position, link
     Returns:
-        - player_info (dict) --> Dictionary version of df
+        - player_info (dict) --> Dictionary version of the search result
         - player_stats_json (json) --> Scraped json file of player match stats
         - player_rumors_json (json) --> Scraped json file of player transfer rumors
     """
-    # Initialize an empty dictionary to store info
-    player_info = {}
-
-    for col in df.columns:
-        # More specific position information will be retrieved later
-        if col == 'Position':
-            pass
-        else:
-            player_info[col.lower()] = df.loc[0][col]
+    # More specific position information will be retrieved later
+    player_info = {'name': player.name, 'club': player.club, 'link': player.link}
 
     # Get stats such as Goals, Assists, etc.
-    player_info, player_stats_json, player_rumors_json = get_stats(player_info)
+    player_info, player_stats_json, player_rumors_json = await get_stats(player_info)
 
     return player_info, player_stats_json, player_rumors_json
 
-# Below is a function used to retrieve player stats and rumors from TransferMarkt's API.
-def get_stats(p_info):
+# Below is a function used to retrieve a player's profile header and availability status.
+@cache.coalesce('player_profile', ('player_header', 'player_status'))
+async def get_player_profile(player_id, player_url):
     """
-    Arguments: 
-        - p_info (dict): Dictionary of player name, club, and TransferMarkt URL
+    Arguments:
+        - player_id (str) --> Player's TransferMarkt ID
+        - player_url (str) --> Player's TransferMarkt URL
     Returns:
-        - p_info (dict): Updated dictionary of player info
-        - player_stats_json (json) --> json file containing player's season stats
-        - player_rumors_embeds (dict) --> dictionary of player's transfer rumors
+        - header (dict) --> Player image URL, position and club link (cached long)
+        - status (str) --> Player's availability status (cached short)
     """
-
-    # Retrieve player's TransferMarkt URL and ID
-    player_url = p_info['link']
-    p_info['id'] = player_url.split("/")[-1]
-
-    # Perform the scrape, obtain HTML data in soup
-    page = requests.get(player_url, headers=config.headers)
-    soup = BeautifulSoup(page.content, 'lxml')
-
-    # Retrieve player image URL
-    p_info['image_url'] = soup.find('img',
-                                    {'class': 'data-header__profile-image'}).get('src')
-
-    # Retrieve player position
-    for label in soup.find_all('li', {'class': 'data-header__label'}):
-        if label.get_text(strip=True).startswith('Position:'):
-            p_info['position'] = label.get_text(strip=True).replace('Position:', '')
-
-    # Get player stats (Injury, International Calls)
+    header = cache.store.get('player_header', player_id)
+    status = cache.store.get('player_status', player_id)
+    if header is not None and status is not None:
+        return header, status
+
+    # Serve a recently expired profile instantly, and revalidate it in the background
+    recent_header = header or cache.store.get_recent('player_header', player_id)
+    recent_status = status or cache.store.get_recent('player_status', player_id)
+    if recent_header is not None and recent_status is not None:
+        cache.revalidate(get_player_profile, player_id, player_url)
+        return recent_header, recent_status
+
+    # Perform the scrape and parse the header and availability status
+    # (streamed, stopping the download once the header and injury box have been read)
     try:
-        p_info["status"] = soup.find_all('div', {'class': 'verletzungsbox'})[0].find_all('div', {'class': 'text'})[0].get_text(separator = ': ', strip=True)
-    except IndexError:
-        p_info["status"] = "Available"
-
-    # Retrieve club page link
-    p_info['clublink'] = soup.find_all('span', {'class': 'data-header__club'})[0].find_all('a')[0].get('href')
+        if config.stream_profiles:
+            header, status = await fetch.fetch_streamed(player_url, 'profile', parse.ProfileExtractor)
+        else:
+            header, status = await fetch_parsed(player_url, 'profile', parse.parse_player_profile)
+    except fetch.fetch_errors:
+        # Serve an expired profile if transfermarkt is failing
+        header = cache.store.get_stale('player_header', player_id)
+        if header is None:
+            raise
+        return header, cache.store.get_stale('player_status', player_id) or "Unknown"
+
+    cache.store.set('player_header', player_id, header)
+    cache.store.set('player_status', player_id, status)
+    return header, status
+
+# Below is a function used to retrieve a player's season stats from TransferMarkt's API.
+@cache.coalesce('performance')
+async def get_player_performance(player_id):
+    """
+    Arguments: player_id (str) --> Player's TransferMarkt ID
+    Returns: player_stats_json (json) --> json file containing player's season stats (None if unavailable)
+    """
+    player_stats_json = cache.store.get('performance', player_id)
+    if player_stats_json is not None:
+        return player_stats_json
 
-    # Retrieve player stats
-    stats_link = "https://www.transfermarkt.us/ceapi/player/" + p_info['id'] + "/performance"
-    response = requests.get(stats_link, headers=config.headers, timeout=1)
+    player_stats_json = cache.store.get_recent('performance', player_id)
+    if player_stats_json is not None:
+        cache.revalidate(get_player_performance, player_id)
+        return player_stats_json
 
     # Stats are stored in a .json file
-    player_stats_json = response.json()
+    stats_link = config.tm_ceapi + '/player/' + player_id + '/performance'
+    try:
+        player_stats_json = await fetch_parsed(stats_link, 'performance', parse.parse_json)
+    except fetch.fetch_errors:
+        return cache.store.get_stale('performance', player_id)
 
-    # Clean up .json file
+    # Clean up player stats .json file
     for tournament in player_stats_json:
         # Unique case of "AFC Champions League" being two rows long despite being 20 characters
         if tournament['competitionDescription'] == 'AFC Champions League':
             tournament['competitionDescription'] = 'AFC CL'
 
-    # Retrieve player transfer rumors
-    rumor_link = 'https://www.transfermarkt.us/ceapi/currentRumors/player/' + p_info['id']
-    response = requests.get(rumor_link, headers=config.headers, timeout=1)
-    rumors_json = response.json()['rumors']
+    cache.store.set('performance', player_id, player_stats_json)
+    return player_stats_json
 
-    # Check if rumors exist:
-    if rumors_json:
-        # Initialize empty dictionary for rumors
-        player_rumors = {}
-        for rumor in rumors_json:
-            club = rumor['club']['name']
-            # Transfermarkt sometimes has duplicate team entries, so ensure there are no duplicates:
-            if club in player_rumors:
-                pass
-            else:
-                player_rumors[club] = rumor['probability']
+# Below is a function used to retrieve a player's transfer rumors from TransferMarkt's API.
+@cache.coalesce('rumors')
+async def get_player_rumors(player_id):
+    """
+    Arguments: player_id (str) --> Player's TransferMarkt ID
+    Returns: rumors_json (list) --> Raw list of transfer rumors (None if unavailable)
+    """
+    rumors_json = cache.store.get('rumors', player_id)
+    if rumors_json is not None:
+        return rumors_json
 
-        # Clean up dictionary for embeds otuput
-        player_rumors_embeds = {'teams': "", 'probability': ""}
+    rumors_json = cache.store.get_recent('rumors', player_id)
+    if rumors_json is not None:
+        cache.revalidate(get_player_rumors, player_id)
+        return rumors_json
 
-        for team in player_rumors:
-            player_rumors_embeds['teams'] += f"{team}\n"
-            if not player_rumors[team]:
-                player_rumors_embeds['probability'] += "Unknown\n"
-            else:
-                player_rumors_embeds['probability'] += f"{player_rumors[team]}%\n"
+    rumor_link = config.tm_ceapi + '/currentRumors/player/' + player_id
+    try:
+        rumors_json = (await fetch_parsed(rumor_link, 'rumors', parse.parse_json))['rumors']
+    except fetch.fetch_errors:
+        return cache.store.get_stale('rumors', player_id)
 
-    else:
-        player_rumors_embeds = None
+    cache.store.set('rumors', player_id, rumors_json)
+    return rumors_json
 
+# Below is a function used to retrieve player stats and rumors from TransferMarkt's API.
+@metrics.timed('get_stats')
+async def get_stats(p_info):
+    """
+    Arguments:
+        - p_info (dict): Dictionary of player name, club, and TransferMarkt URL
+    Returns:
+        - p_info (dict): Updated dictionary of player info
+        - player_stats_json (json) --> json file containing player's season stats
+        - player_rumors_embeds (dict) --> dictionary of player's transfer rumors
+    """
+    # Wait for every part of the player's data
+    async for p_info, player_stats_json, player_rumors_embeds in stream_stats(p_info):
+        pass
     return p_info, player_stats_json, player_rumors_embeds
 
+# Below is a function that yields a player's data each time one more part of it has been retrieved.
+async def stream_stats(p_info):
+    """
+    Arguments:
+        - p_info (dict): Dictionary of player name, club, and TransferMarkt URL
+    Yields: (p_info, player_stats_json, player_rumors_embeds) --> Same as get_stats, starting with
+            the search result alone. Parts still loading are listed in p_info['pending'].
+    """
+    # Retrieve player's TransferMarkt URL and ID
+    player_url = p_info['link']
+    p_info['id'] = player_url.split("/")[-1]
+    cache.popularity.record('player', p_info['id'], player_url)
+
+    # Failing ceapi endpoints leave a partial result, which the embed marks as unavailable
+    p_info['pending'] = ['profile', 'performance', 'rumors']
+    p_info['unavailable'] = []
+    player_stats_json, player_rumors_embeds = [], None
+    yield p_info, player_stats_json, player_rumors_embeds
+
+    # Perform the profile scrape and both ceapi requests concurrently (cached parts are skipped)
+    parts = {asyncio.ensure_future(get_player_profile(p_info['id'], player_url)): 'profile',
+             asyncio.ensure_future(get_player_performance(p_info['id'])): 'performance',
+             asyncio.ensure_future(get_player_rumors(p_info['id'])): 'rumors'}
+    pending = set(parts)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                part = parts[task]
+                p_info['pending'].remove(part)
+                if part == 'profile':
+                    header, p_info['status'] = task.result()
+                    p_info.update(header)
+                elif task.result() is None:
+                    p_info['unavailable'].append(part)
+                elif part == 'performance':
+                    player_stats_json = task.result()
+                else:
+                    player_rumors_embeds = summarize_rumors(task.result())
+            yield p_info, player_stats_json, player_rumors_embeds
+    finally:
+        for task in pending:
+            task.cancel()
+
+# Below is a function used to convert a player's transfer rumors into embed columns.
+def summarize_rumors(rumors_json):
+    """
+    Arguments: rumors_json (list) --> Raw list of transfer rumors
+    Returns: player_rumors_embeds (dict) --> 'teams' and 'probability' columns, or None if there are no rumors
+    """
+    # Check if rumors exist:
+    if not rumors_json:
+        return None
+
+    # Initialize empty dictionary for rumors
+    player_rumors = {}
+    for rumor in rumors_json:
+        club = rumor['club']['name']
+        # Transfermarkt sometimes has duplicate team entries, so ensure there are no duplicates:
+        if club in player_rumors:
+            pass
+        else:
+            player_rumors[club] = rumor['probability']
+
+    # Clean up dictionary for embeds otuput
+    player_rumors_embeds = {'teams': "", 'probability': ""}
+
+    for team in player_rumors:
+        player_rumors_embeds['teams'] += f"{team}\n"
+        if not player_rumors[team]:
+            player_rumors_embeds['probability'] += "Unknown\n"
+        else:
+            player_rumors_embeds['probability'] += f"{player_rumors[team]}%\n"
+
+    return player_rumors_embeds
+
+# Below is a function used to load a search result's profile and ceapi data into the cache.
+async def prefetch_player(player):
+    """
+    Arguments: player (PlayerResult) --> Search result the user might select
+    """
+    player_id = player.link.split("/")[-1]
+    await asyncio.gather(get_player_profile(player_id, player.link),
+                         get_player_performance(player_id),
+                         get_player_rumors(player_id))
+
 # Below function converts command argument into searchable transfermarkt query.
-def search_club(command_args):
+@metrics.timed('search_club')
+async def search_club(command_args):
     """
     Arguments: command_args (str) --> Name of the club that the user entered
-    Returns: results_df (pd df) --> df of possible clubs with user-entered name
+    Returns: clubs (list[ClubResult]) --> Possible clubs with user-entered name
     """
-    name_query = config.tm_search + '+'.join(command_args.split())
+    query = cache.normalize(command_args)
+
+    # Same order as search_player: cached search, then local name index, then transfermarkt
+    clubs = names.index.lookup('clubs', query, is_senior_club) if not cache.store.fresh('search', query) else None
+    if clubs is None:
+        clubs = [club for club in (await quick_search(query))['clubs'] if is_senior_club(club)]
 
-    # Perform the scrape, obtain HTML data in soup
-    page = requests.get(name_query, headers=config.headers)
-    soup = BeautifulSoup(page.content, 'lxml')
+        # Suggest close names when transfermarkt finds nothing (ex. a typo)
+        if not clubs:
+            clubs = names.index.suggest('clubs', query, is_senior_club)
 
-    # Initialize empty lists for creating dataframe
-    c_name, c_club_link = [], []
+    return [ClubResult(**club) for club in clubs]
 
-    # Start searching through the table of clubs to get club name and link
-    for x in soup.find_all('td', {'class':'hauptlink'}):
-        if x.find_all('a'):
-            if 'startseite' in x.find_all('a')[0].get('href'):
-                c_name.append(x.find_all('a')[0].get('title'))
-                c_club_link.append(config.tm_main + x.find_all('a')[0].get('href'))
+# Below is a function used to check whether a club is a youth or reserve team.
+youth_club_markers = ('Youth', 'U19', 'U21', 'U18', 'U17', 'Reserves')
 
-    # Complete dataframe
-    cols = {'Club': c_name, 'Club Link': c_club_link}
-    results_df = pd.DataFrame(cols)
+def is_youth_club(name):
+    return any(string_to_remove in name for string_to_remove in youth_club_markers)
 
+def is_senior_club(club):
     # Remove youth clubs
-    for string_to_remove in ['Youth', 'U19', 'U21', 'U18', 'U17', 'Reserves']:
-        results_df = results_df[~results_df.Club.str.contains(string_to_remove)]
+    return not is_youth_club(club['name'])
+
+# Below is a function used to retrieve a club's header and league form from its spielplan page.
+@cache.coalesce('club_page', ('club_header', 'club_form'))
+async def get_club_page(club_id, club_link):
+    """
+    Arguments:
+        - club_id (str) --> Club's TransferMarkt ID
+        - club_link (str) --> Club's TransferMarkt spielplan URL
+    Returns:
+        - header (dict) --> Club image URL, league and league link (cached long)
+        - form (dict) --> Table standing and past results (cached short)
+    """
+    header = cache.store.get('club_header', club_id)
+    form = cache.store.get('club_form', club_id)
+    if header is not None and form is not None:
+        return header, form
+
+    # Serve a recently expired club page instantly, and revalidate it in the background
+    recent_header = header or cache.store.get_recent('club_header', club_id)
+    recent_form = form or cache.store.get_recent('club_form', club_id)
+    if recent_header is not None and recent_form is not None:
+        cache.revalidate(get_club_page, club_id, club_link)
+        return recent_header, recent_form
+
+    # Perform the scrape and parse the club header and league form
+    try:
+        header, form = await fetch_parsed(club_link, 'spielplan', parse.parse_club_page)
+    except fetch.fetch_errors:
+        # Serve an expired club page if transfermarkt is failing
+        header = cache.store.get_stale('club_header', club_id)
+        form = cache.store.get_stale('club_form', club_id)
+        if header is None or form is None:
+            raise
+        return header, form
+
+    cache.store.set('club_header', club_id, header)
+    cache.store.set('club_form', club_id, form)
+    return header, form
+
+# Below is a function used to retrieve a club's upcoming matches from TransferMarkt's API.
+@cache.coalesce('next_matches')
+async def get_next_matches(club_id):
+    """
+    Arguments: club_id (str) --> Club's TransferMarkt ID
+    Returns: next_matches_json (dict) --> json file with 'teams' and 'matches' (None if unavailable)
+    """
+    next_matches_json = cache.store.get('next_matches', club_id)
+    if next_matches_json is not None:
+        return next_matches_json
+
+    next_matches_json = cache.store.get_recent('next_matches', club_id)
+    if next_matches_json is not None:
+        cache.revalidate(get_next_matches, club_id)
+        return next_matches_json
+
+    next_matches_site = config.tm_ceapi + '/nextMatches/team/' + club_id
+    try:
+        next_matches_json = await fetch_parsed(next_matches_site, 'next_matches', parse.parse_json)
+    except fetch.fetch_errors:
+        return cache.store.get_stale('next_matches', club_id)
 
-    # Reset index
-    results_df = results_df.reset_index(drop=True)
-    return results_df
+    cache.store.set('next_matches', club_id, next_matches_json)
+    return next_matches_json
 
-def process_df_clubs(df):
+# Below is a function used to load a club search result's spielplan and next matches into the cache.
+async def prefetch_club(club):
     """
-    Arguments: df (pd df) --> Single-row pandas dataframe containing selected club
+    Arguments: club (ClubResult) --> Search result the user might select
+    """
+    club_id = club.link.split('/')[-1]
+    await asyncio.gather(get_club_page(club_id, club.link.replace('startseite', 'spielplan')),
+                         get_next_matches(club_id))
+
+# Below is a function that prefetches the top search results while the user picks one of them.
+def prefetch(prefetcher, candidates):
+    """
+    Arguments:
+        - prefetcher (function) --> prefetch_player or prefetch_club
+        - candidates (list) --> Search results, in the order they are displayed
+    Returns: tasks (list[asyncio.Task]) --> One task per prefetched candidate, to cancel once the user picks
+    """
+    slots = asyncio.Semaphore(config.prefetch_concurrency)
+
+    async def run(candidate, group):
+        async with slots:
+            # Speculative requests wait behind every command's requests, until promote_prefetch
+            scheduler.current_priority.set(scheduler.BACKGROUND)
+            scheduler.current_group.set(group)
+            try:
+                await prefetcher(candidate)
+            except fetch.fetch_errors:
+                pass
+
+    tasks = []
+    for candidate in candidates[:config.prefetch_candidates]:
+        group = scheduler.RequestGroup()
+        task = asyncio.ensure_future(run(candidate, group))
+        prefetch_groups[task] = group
+        task.add_done_callback(lambda task: prefetch_groups.pop(task, None))
+        tasks.append(task)
+    return tasks
+
+# Request group of each running prefetch task
+prefetch_groups = {}
+
+# Below is a function that raises a prefetch the user selected to command priority, since the command now shares its requests.
+def promote_prefetch(task):
+    group = prefetch_groups.get(task)
+    if group is not None:
+        scheduler.outbound.promote(group)
+
+@metrics.timed('process_df_clubs')
+async def process_df_clubs(club):
+    """
+    Arguments: club (ClubResult) --> Selected club search result
     Returns: club_info (dict) --> Dictionary containing club information
     """
+    # Wait for every part of the club's data
+    async for club_info in stream_club(club):
+        pass
+    return club_info
+
+# Below is a function that yields a club's information each time one more part of it has been retrieved.
+async def stream_club(club):
+    """
+    Arguments: club (ClubResult) --> Selected club search result
+    Yields: club_info (dict) --> Same as process_df_clubs, starting with the search result alone.
+            Parts still loading are listed in club_info['pending'].
+    """
     # Initialize an empty dictionary to store info
     club_info = {}
 
-    # 1. Extract club information from df
-    club_info['name'] = df.loc[0]['Club']
-    club_info['link'] = df.loc[0]['Club Link']
-    club_info['id'] = df.loc[0]['Club Link'].split('/')[-1]
+    # 1. Extract club information from the search result
+    club_info['name'] = club.name
+    club_info['link'] = club.link
+    club_info['id'] = club.link.split('/')[-1]
+    cache.popularity.record('club', club_info['id'], club)
+    club_info['pending'] = ['club_page', 'next_matches']
+    yield club_info
 
-    # Perform the scrape, obtain HTML data in soup
+    # 2. Perform the spielplan scrape and the next matches ceapi request concurrently
+    # This retrieves club image, league, standing and past match results
     club_info['link'] = club_info['link'].replace('startseite', 'spielplan')
-    page = requests.get(club_info['link'], headers=config.headers)
-    soup = BeautifulSoup(page.content, 'lxml')
-
-    # 2. Get club image url
-    img_query = soup.find_all('div', {'class':'data-header__profile-container'})[0]
-    club_info['image_url'] = img_query.find('img').get('src')
-
-    # 3. Get club league
-    club_info['league'] = soup.find_all('span', {'class':"data-header__club"})[0].get_text(strip=True)
-    club_info['league_link'] = soup.find_all('span', {'class':"data-header__club"})[0].find('a').get('href')
-
-    # 4. Get club standing
-    club_info['standing'] = soup.find_all('span', {'class':"data-header__content"})[1].find('a').get_text(strip=True)
-
-    # 5. Scrape past match results
-    results = []
-    for x in soup.find_all('div', {'class': 'box'}):
-        h2_a = x.find('h2').find('a')
-        if h2_a and club_info['league_link'] in h2_a.get('href'):
-            table = x.find('div', {'class': 'responsive-table'}).find('table').find('tbody').find_all('tr')
-            for table_2 in table:
-                for match in table_2.find_all('td', {'class': 'zentriert'}):
-                    a_span = match.find('a').find('span') if match.find('a') else None
-                    if a_span:
-                        score = a_span.text.strip()
-                        if score[0] != '-':
-                            result = a_span.get('class')
-                            results.append('D' if not result else 'W' if result[0] == 'greentext' else 'L')
-
-    club_info['past_results'] = (" ").join(results[-5:])
-
-    # 6. Get next match info
-    next_matches_site = 'https://www.transfermarkt.us/ceapi/nextMatches/team/' + club_info['id']
-    page = requests.get(next_matches_site, headers=config.headers)
-
-    teams = page.json()['teams']
-    next_matches = page.json()['matches']
-
+    parts = {asyncio.ensure_future(get_club_page(club_info['id'], club_info['link'])): 'club_page',
+             asyncio.ensure_future(get_next_matches(club_info['id'])): 'next_matches'}
+    pending = set(parts)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                part = parts[task]
+                club_info['pending'].remove(part)
+                if part == 'club_page':
+                    header, form = task.result()
+                    club_info.update(header)
+                    club_info.update(form)
+                else:
+                    add_next_matches(club_info, task.result())
+            yield club_info
+    finally:
+        for task in pending:
+            task.cancel()
+
+# Below is a function used to add a club's next matches to its information.
+def add_next_matches(club_info, next_matches_json):
+    """
+    Arguments:
+        - club_info (dict) --> Dictionary containing club information
+        - next_matches_json (dict) --> json file with 'teams' and 'matches' (None if unavailable)
+    """
+    # 3. Get next match info
     club_info['next_match_timestamp'] = ""
     club_info['next_match_opponent_name'] = ""
     club_info['next_match_league'] = ""
 
+    # A failing nextMatches endpoint leaves a partial result
+    if next_matches_json is None:
+        club_info['next_match_opponent_name'] = "Currently unavailable"
+        club_info['next_match_league'] = "-"
+        club_info['next_match_timestamp'] = "-"
+        return
+
+    teams = next_matches_json['teams']
+    next_matches = next_matches_json['matches']
+
     for match in next_matches[0:5]:
         # Parse information
         awayteam_id = match['match']['away']
@@ -254,5 +560,3 @@ def process_df_clubs(df):
             club_info['next_match_opponent_name'] += f"{teams[str(awayteam_id)]['name']}\n"
 
         club_info['next_match_league'] += f"[{match['competition']['label']}]({match['competition']['link']})\n"
-    
-    return club_info
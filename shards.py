@@ -0,0 +1,70 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import discord
+
+# Local imports
+import config
+
+# Below is a function that asks Discord how many shards the bot should run.
+async def recommended_shard_count(token):
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shard_count, _, _ = await http.get_bot_gateway()
+        return shard_count
+    finally:
+        await http.close()
+
+# Below is a function that splits the shard IDs evenly between processes.
+def split(shard_count, processes):
+    """
+    Arguments:
+        - shard_count (int) --> Total number of shards
+        - processes (int) --> Number of bot processes
+    Returns: shard_ids (list[list[int]]) --> Shard IDs run by each process (ex. [[0, 2], [1, 3]])
+    """
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+# Below is a function that runs the bot as several processes, each with its own event loop and shards.
+def launch(token):
+    """
+    Arguments: token (str) --> Discord bot token
+    Each process re-runs bot.py with SHARD_PROCESS, SHARD_IDS and SHARD_COUNT set. They are stopped
+    together: when one exits, or when the launcher is interrupted (SIGINT or SIGTERM).
+    """
+    shard_count = config.shard_count or asyncio.run(recommended_shard_count(token))
+
+    # Never more processes than shards
+    assignments = [shard_ids for shard_ids in split(shard_count, config.shard_processes) if shard_ids]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+    processes = []
+    for index, shard_ids in enumerate(assignments):
+        env = dict(os.environ, SHARD_PROCESSES=str(len(assignments)), SHARD_PROCESS=str(index),
+                   SHARD_COUNT=str(shard_count), SHARD_IDS=','.join(map(str, shard_ids)))
+        # In their own session, so a Ctrl-C reaches them once, forwarded by the launcher
+        processes.append(subprocess.Popen([sys.executable, script], env=env, start_new_session=True))
+        print(f'Started bot process {index} (pid {processes[-1].pid}) with shards {shard_ids} of {shard_count}')
+
+    # Stopped by a service manager like by a Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        os.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Interrupted, each process closes the bot and saves its snapshot, and is only killed past the timeout
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        deadline = time.monotonic() + config.shard_shutdown_timeout
+        for process in processes:
+            try:
+                process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                process.terminate()
+                process.wait()
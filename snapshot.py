@@ -0,0 +1,78 @@
+import gzip
+import json
+import os
+import time
+
+# Local imports
+import cache
+import config
+import refresh
+from records import ClubResult
+
+# Cache kinds making up the embed of a player and a club looked up by popularity
+popular_kinds = {'player': refresh.player_kinds, 'club': refresh.club_kinds}
+
+# Below are functions converting the refresh arguments kept by cache.popularity to and from json.
+def encode_args(kind, args):
+    return [args[0].name, args[0].link] if kind == 'club' else list(args)
+
+def decode_args(kind, args):
+    return (ClubResult(*args),) if kind == 'club' else tuple(args)
+
+# Below is a function that writes the most looked up players and clubs, and the latest searches, to a compact snapshot.
+def save(path=config.snapshot_path):
+    """
+    Arguments: path (str) --> Snapshot file (gzipped json)
+    Returns: saved (int) --> Number of cache entries written
+    Entries are chosen from the lookup counts of commands, not from the memory tier, which background
+    writes (ex. ingestion) would otherwise fill with players nobody asked for.
+    """
+    popular = cache.popularity.ranked()
+    entries = []
+    for kind, key, score, args in popular:
+        if len(entries) >= config.snapshot_entries:
+            break
+        for part in popular_kinds[kind]:
+            entry = cache.store.get_entry(part, key)
+            if entry is not None:
+                entries.append([part, key, *entry])
+    # Searches are only run by commands, most recently used first
+    entries += [['search', key, value, expires] for (kind, key), (value, size, expires)
+                in reversed(cache.store.memory.items()) if kind == 'search']
+    entries = entries[:config.snapshot_entries]
+
+    snapshot = {'saved_at': time.time(),
+                # Least important first, so that loading them in order leaves the most looked up players
+                # and clubs as the most recently used entries of the memory tier
+                'entries': entries[::-1],
+                'popular': [[kind, key, score, encode_args(kind, args)] for kind, key, score, args in popular]}
+
+    # Compressed in one go (json.dump writes many small pieces), next to the old snapshot and swapped
+    # in, so a crash never leaves a partial file
+    encoded = json.dumps(snapshot, separators=(',', ':')).encode()
+    with open(path + '.tmp', 'wb') as file:
+        file.write(gzip.compress(encoded, compresslevel=config.snapshot_compression))
+    os.replace(path + '.tmp', path)
+    return len(entries)
+
+# Below is a function that warms the cache, name index and popularity tracker from a snapshot.
+def load(path=config.snapshot_path):
+    """
+    Arguments: path (str) --> Snapshot file written by save
+    Returns: loaded (int) --> Number of cache entries read (0 without a readable snapshot)
+    """
+    try:
+        with open(path, 'rb') as file:
+            snapshot = json.loads(gzip.decompress(file.read()))
+    except (OSError, EOFError, ValueError):
+        # Without a snapshot (or with a damaged one) the bot only starts cold
+        return 0
+
+    # Searches written back to the disk tier are picked up by names.index, which is built on first use
+    cache.store.warm(snapshot['entries'])
+
+    # Lookup counts keep decaying while the bot is stopped
+    decay = 0.5 ** ((time.time() - snapshot['saved_at']) / config.refresh_half_life)
+    for kind, key, score, args in snapshot['popular']:
+        cache.popularity.restore(kind, key, score * decay, decode_args(kind, args))
+    return len(snapshot['entries'])
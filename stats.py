@@ -0,0 +1,311 @@
+import hashlib
+import os
+
+import numpy as np
+
+# Local imports
+import cache
+import config
+import names
+
+# Performance json fields kept for every player and competition
+stat_fields = ('gamesPlayed', 'goalsScored', 'assists', 'startElevenPercent', 'cleanSheets', 'concededGoals')
+
+# Stat names accepted by the !leaders command
+stat_aliases = {'apps': 'gamesPlayed', 'games': 'gamesPlayed', 'goals': 'goalsScored', 'assists': 'assists',
+                'starts': 'startElevenPercent', 'se': 'startElevenPercent', 'cleansheets': 'cleanSheets',
+                'cs': 'cleanSheets', 'conceded': 'concededGoals'}
+
+# Titles of the stats, for embeds
+stat_labels = {'gamesPlayed': 'Apps', 'goalsScored': 'Goals', 'assists': 'Assists', 'startElevenPercent': 'Starting Eleven %',
+               'cleanSheets': 'Clean Sheets', 'concededGoals': 'Goals Conceded'}
+
+# Stats shown by display_goalkeeper rather than display_outfield
+goalkeeper_fields = ('cleanSheets', 'concededGoals')
+
+# One row per (player, competition); competitions are indexes into StatsStore.competitions
+row_dtype = np.dtype([('player', 'i8'), ('competition', 'i4')] +
+                     [(field, 'f4' if field == 'startElevenPercent' else 'i4') for field in stat_fields])
+
+# Below is a local columnar store of the season stats of every player in the ingested leagues.
+class StatsStore:
+    """
+    Each player's rows are kept as a small structured array next to a hash of the performance json
+    they were built from, so an unchanged player is never rewritten. columns() concatenates every
+    player's rows into one array per field (plus the club and league of each row) for vectorized
+    queries, and save() writes the same arrays to a compressed .npz file (no pickled objects).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}
+        self.hashes = {}
+        self.players = {}
+        self.clubs = {}
+        self.leagues = {}
+        self.competitions = []
+        self.competition_index = {}
+        self.changed = False
+        self.saved_at = None
+        self._columns = None
+        self._names = None
+        if os.path.exists(path):
+            self.load()
+
+    # Below is a function returning the index of a competition, adding it if it is new.
+    def _competition(self, tournament):
+        competition_id = tournament.get('competitionId') or tournament['competitionDescription']
+        if competition_id not in self.competition_index:
+            self.competition_index[competition_id] = len(self.competitions)
+            self.competitions.append((competition_id, tournament['competitionDescription']))
+        return self.competition_index[competition_id]
+
+    def _touch(self):
+        self.changed = True
+        self._columns = None
+        self._names = None
+
+    # Below is a function used to store a league's name and link.
+    def set_league(self, code, name, link):
+        if self.leagues.get(code) != (name, link):
+            self.leagues[code] = (name, link)
+            self._touch()
+
+    # Below is a function used to check whether a club played since its squad was last ingested.
+    def club_changed(self, club_id, games):
+        club = self.clubs.get(int(club_id))
+        return club is None or club[2] != games
+
+    # Below is a function used to record a club once its whole squad has been ingested.
+    def set_club(self, club_id, name, league, games, squad):
+        """
+        Arguments:
+            - club_id (str) --> Club's TransferMarkt ID
+            - name (str) --> Club name
+            - league (str) --> League code, ex. 'GB1'
+            - games (int) --> League games played, compared on the next ingestion
+            - squad (list[str]) --> Player IDs of the current squad (players who left are dropped)
+        """
+        club_id = int(club_id)
+        squad = {int(player_id) for player_id in squad}
+        for player_id in [player_id for player_id, player in self.players.items()
+                          if player[2] == club_id and player_id not in squad]:
+            del self.players[player_id], self.rows[player_id], self.hashes[player_id]
+        self.clubs[club_id] = (name, league, games)
+        self._touch()
+
+    # Below is a function used to store a player's performance json, unless it did not change.
+    def update_player(self, player_id, name, position, club_id, player_stats_json):
+        """
+        Arguments:
+            - player_id (str) --> Player's TransferMarkt ID
+            - name, position (str) --> From the club's squad page
+            - club_id (str) --> Club's TransferMarkt ID
+            - player_stats_json (json) --> Player's season stats, as returned by scrape.get_player_performance
+        Returns: changed (bool) --> Whether the player's rows were rewritten
+        """
+        player_id, club_id = int(player_id), int(club_id)
+        digest = hashlib.blake2b(repr((name, position, club_id, player_stats_json)).encode(), digest_size=16).digest()
+        if self.hashes.get(player_id) == digest:
+            return False
+
+        rows = np.zeros(len(player_stats_json), dtype=row_dtype)
+        for row, tournament in zip(rows, player_stats_json):
+            row['player'] = player_id
+            row['competition'] = self._competition(tournament)
+            for field in stat_fields:
+                row[field] = tournament.get(field) or 0
+        self.rows[player_id] = rows
+        self.hashes[player_id] = digest
+        self.players[player_id] = (name, position, club_id)
+        self._touch()
+        return True
+
+    # Below is a function returning every stored row as one array per column.
+    def columns(self):
+        """
+        Returns: columns (dict) --> Arrays of equal length: the row_dtype fields, plus 'club' (club ID)
+                 and 'league' (league code) of each row's player
+        """
+        if self._columns is None:
+            rows = np.concatenate(list(self.rows.values())) if self.rows else np.zeros(0, dtype=row_dtype)
+
+            # Club and league of each player, spread to their rows through the sorted player IDs
+            player_ids = np.fromiter(self.players, dtype='i8', count=len(self.players))
+            player_clubs = np.fromiter((player[2] for player in self.players.values()), dtype='i8', count=len(self.players))
+            player_leagues = np.array([self.clubs.get(player[2], ('', ''))[1] for player in self.players.values()], dtype='U16')
+            order = np.argsort(player_ids)
+            position = order[np.searchsorted(player_ids[order], rows['player'])]
+            club, league = player_clubs[position], player_leagues[position]
+            self._columns = {name: rows[name] for name in row_dtype.names}
+            self._columns['club'] = club
+            self._columns['league'] = league
+        return self._columns
+
+    # Below is a function returning a name index of the stored players and clubs, rebuilt after changes.
+    def name_index(self):
+        if self._names is None:
+            self._names = names.NameIndex()
+            self._names.add({'players': [{'name': player[0], 'link': player_id} for player_id, player in self.players.items()],
+                             'clubs': [{'name': club[0], 'link': club_id} for club_id, club in self.clubs.items()]})
+        return self._names
+
+    # Below is a function used to find a stored player or club by name.
+    def find(self, kind, query):
+        """
+        Arguments:
+            - kind (str) --> 'players' or 'clubs'
+            - query (str) --> Name entered by the user
+        Returns: key (int) --> Player or club ID of the closest name, or None
+        """
+        scored = self.name_index().scored(kind, cache.normalize(query), lambda row: True, config.name_index_suggest_score)
+        return scored[0][2]['link'] if scored else None
+
+    # Below is a function used to find an ingested league by code or name (ex. 'GB1', 'premier league').
+    def find_league(self, query):
+        query = cache.normalize(query)
+        for code, (name, _) in self.leagues.items():
+            if query in (code.lower(), cache.normalize(name)):
+                return code
+        return None
+
+    # Below is a function that sums the stats of each player over the selected rows.
+    def totals(self, mask):
+        """
+        Arguments: mask (np.ndarray[bool]) --> Rows of columns() to include
+        Returns:
+            - players (np.ndarray) --> Player IDs, sorted
+            - totals (dict) --> Array per stat field, aligned with players. startElevenPercent is
+              averaged over the player's games instead of summed.
+        """
+        columns = self.columns()
+        players, inverse = np.unique(columns['player'][mask], return_inverse=True)
+        totals = {field: np.bincount(inverse, weights=columns[field][mask], minlength=len(players))
+                  for field in stat_fields}
+        weighted = np.bincount(inverse, weights=columns['startElevenPercent'][mask] * columns['gamesPlayed'][mask],
+                               minlength=len(players))
+        games = totals['gamesPlayed']
+        totals['startElevenPercent'] = np.divide(weighted, games, out=np.zeros_like(weighted), where=games > 0)
+        return players, totals
+
+    # Below is a function returning the players of a league with the highest total of one stat.
+    def leaders(self, code, field, count):
+        """
+        Arguments:
+            - code (str) --> League code, ex. 'GB1'
+            - field (str) --> One of stat_fields
+            - count (int) --> Number of players to return
+        Returns: leaders (list[dict]) --> Performance json style rows, named after each player, best first
+        """
+        columns = self.columns()
+        mask = columns['league'] == code
+
+        # Only the league's own competition counts (ex. Premier League goals, not FA Cup goals)
+        league_name = self.leagues[code][0]
+        competition = [index for index, (_, name) in enumerate(self.competitions) if name == league_name]
+        if competition:
+            mask &= columns['competition'] == competition[0]
+
+        players, totals = self.totals(mask)
+        count = min(count, len(players))
+        if not count:
+            return []
+        best = np.argpartition(-totals[field], count - 1)[:count]
+        best = best[np.argsort(-totals[field][best], kind='stable')]
+        return self._rows(players[best], {name: values[best] for name, values in totals.items()})
+
+    # Below is a function returning the season totals of every player of a club.
+    def squad(self, club_id):
+        """
+        Arguments: club_id (int) --> Club's TransferMarkt ID
+        Returns: squad (list[dict]) --> Performance json style rows, named after each player, most games first
+        """
+        players, totals = self.totals(self.columns()['club'] == club_id)
+        order = np.argsort(-totals['gamesPlayed'], kind='stable')
+        return self._rows(players[order], {name: values[order] for name, values in totals.items()})
+
+    # Below is a function returning a player's stored rows, as the performance json they were read from.
+    def player_stats(self, player_id):
+        rows = self.rows[player_id]
+        return [{'competitionDescription': self.competitions[row['competition']][1],
+                 **{field: row[field].item() for field in stat_fields}} for row in rows]
+
+    # Below is a function turning per-player totals into rows that the display_* embeds can list.
+    def _rows(self, players, totals):
+        rows = []
+        for index, player_id in enumerate(players.tolist()):
+            name, position, club_id = self.players[player_id]
+            row = {'competitionDescription': name, 'position': position, 'club': self.clubs.get(club_id, ('',))[0]}
+            for field in stat_fields:
+                value = totals[field][index].item()
+                row[field] = value if field == 'startElevenPercent' else int(value)
+            rows.append(row)
+        return rows
+
+    # Below is a function to write the store to disk, replacing the previous file atomically.
+    def save(self):
+        if not self.changed:
+            return
+        player_ids = list(self.players)
+        rows = np.concatenate([self.rows[player_id] for player_id in player_ids]) if player_ids else np.zeros(0, dtype=row_dtype)
+        temporary = self.path + '.tmp.npz'
+        np.savez_compressed(
+            temporary, rows=rows,
+            player_ids=np.array(player_ids, dtype='i8'),
+            player_names=np.array([self.players[player_id][0] for player_id in player_ids], dtype=str),
+            player_positions=np.array([self.players[player_id][1] for player_id in player_ids], dtype=str),
+            player_clubs=np.array([self.players[player_id][2] for player_id in player_ids], dtype='i8'),
+            player_hashes=np.array([self.hashes[player_id] for player_id in player_ids], dtype='S16'),
+            club_ids=np.array(list(self.clubs), dtype='i8'),
+            club_names=np.array([club[0] for club in self.clubs.values()], dtype=str),
+            club_leagues=np.array([club[1] for club in self.clubs.values()], dtype=str),
+            club_games=np.array([club[2] for club in self.clubs.values()], dtype='i4'),
+            league_codes=np.array(list(self.leagues), dtype=str),
+            league_names=np.array([league[0] for league in self.leagues.values()], dtype=str),
+            league_links=np.array([league[1] for league in self.leagues.values()], dtype=str),
+            competition_ids=np.array([competition[0] for competition in self.competitions], dtype=str),
+            competition_names=np.array([competition[1] for competition in self.competitions], dtype=str))
+        os.replace(temporary, self.path)
+        self.changed = False
+        self.saved_at = os.path.getmtime(self.path)
+
+    # Below is a function that reads the store again if another bot process saved a newer version.
+    def reload(self):
+        if self.changed or not os.path.exists(self.path) or os.path.getmtime(self.path) == self.saved_at:
+            return
+        self.rows, self.hashes, self.players, self.clubs = {}, {}, {}, {}
+        self._columns = self._names = None
+        self.load()
+
+    # Below is a function to read the store written by save().
+    def load(self):
+        self.saved_at = os.path.getmtime(self.path)
+        with np.load(self.path) as saved:
+            rows = saved['rows']
+            player_ids = saved['player_ids'].tolist()
+            for player_id, name, position, club_id, digest in zip(player_ids, saved['player_names'].tolist(),
+                                                                  saved['player_positions'].tolist(),
+                                                                  saved['player_clubs'].tolist(),
+                                                                  saved['player_hashes'].tolist()):
+                self.players[player_id] = (name, position, club_id)
+                self.hashes[player_id] = digest
+            # Rows were saved grouped by player, so each run of one player ID is that player's rows
+            starts = np.flatnonzero(np.r_[True, rows['player'][1:] != rows['player'][:-1]]) if len(rows) else []
+            for start, end in zip(starts, list(starts[1:]) + [len(rows)]):
+                self.rows[int(rows['player'][start])] = rows[start:end].copy()
+            for player_id in player_ids:
+                self.rows.setdefault(player_id, np.zeros(0, dtype=row_dtype))
+            self.clubs = {club_id: (name, league, games) for club_id, name, league, games in
+                          zip(saved['club_ids'].tolist(), saved['club_names'].tolist(),
+                              saved['club_leagues'].tolist(), saved['club_games'].tolist())}
+            self.leagues = {code: (name, link) for code, name, link in
+                            zip(saved['league_codes'].tolist(), saved['league_names'].tolist(),
+                                saved['league_links'].tolist())}
+            self.competitions = list(zip(saved['competition_ids'].tolist(), saved['competition_names'].tolist()))
+            self.competition_index = {competition[0]: index for index, competition in enumerate(self.competitions)}
+
+    def stats(self):
+        return {'players': len(self.players), 'rows': sum(len(rows) for rows in self.rows.values()),
+                'clubs': len(self.clubs), 'leagues': len(self.leagues)}
+
+# Shared store, filled by the ingest module
+store = StatsStore(config.stats_path)